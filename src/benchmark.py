@@ -20,12 +20,15 @@ from qiskit import Aer
 from qiskit.providers.aer import AerError
 from qiskit.utils import QuantumInstance
 from qiskit.circuit.library import TwoLocal
-from qiskit.algorithms.optimizers import COBYLA
+from qiskit.algorithms.optimizers import COBYLA, L_BFGS_B, SLSQP
 
 from solver.cvxpy.cvxpy_solver import CVXPYSolver
+from solver.qp.qp_solver import QPSolver
 from solver.ils.ils import ILSSolver
+from solver.cache import ArtifactCache, CircuitCache
 from data_factory.utils import rand_data
 from data_factory.market import Market
+from data_factory.loader import load_prices
 
 __available_methods = ["random", "brownian_motion", "loading"]
 
@@ -33,9 +36,8 @@ def main(args):
 
     if args.data_method == "brownian_motion" or args.data_method == "random":
         data = rand_data(args.num_assets , args.time_period , method=args.data_method)
-    elif args.data_type == "loading":
-        with open(args.path, 'rb') as f:
-            data = np.load(f)
+    elif args.data_method == "load":
+        data = load_prices(args.data_path, assets=args.assets, dtype=np.float32 if args.float32 else np.float64)
 
     market = Market(data)
 
@@ -44,11 +46,25 @@ def main(args):
     mu = market.mu
     # mu = np.zeros((args.num_assets)) # Minimize the risk
 
-    cvxpy, __ = CVXPYSolver(Cov=Cov, mu=mu, gamma=args.gamma, verbose=False)
+    cache = ArtifactCache(args.cache_dir, max_bytes=args.cache_size * 2**20) if args.cache_dir else None
+
+    reference_solver = QPSolver if args.qp_solver == "numpy" else CVXPYSolver
+    artifacts = None
+    if cache is not None:
+        key = ArtifactCache.key(Cov, mu, args.gamma, args.budget, args.asset_limit, kind="reference")
+        artifacts = cache.get(key)
+    if artifacts is not None:
+        cvxpy = float(artifacts["value"])
+    else:
+        cvxpy, w = reference_solver(Cov=Cov, mu=mu, gamma=args.gamma, budget=args.budget, asset_limit=args.asset_limit, verbose=False)
+        if cache is not None:
+            cache.put(key, value=cvxpy, w=w)
     print("CVXPY: {}".format(cvxpy))
 
     # Prepare quantum instance for benchmark
-    if args.backend == "GPU":
+    if args.backend == "numpy":
+        qi = None
+    elif args.backend == "GPU":
         backend = Aer.get_backend(args.backend_name)
         try:
             backend.set_options(device='GPU')
@@ -61,7 +77,8 @@ def main(args):
         backend = provider.get_backend(args.backend_name)
     else:
         backend = Aer.get_backend(args.backend_name)
-    qi = QuantumInstance(backend, seed_transpiler=args.seed, seed_simulator=args.seed, shots=args.shots)   
+    if args.backend != "numpy":
+        qi = QuantumInstance(backend, seed_transpiler=args.seed, seed_simulator=args.seed, shots=args.shots)   
 
     # ILS Enhanced VQE
     ils = ILSSolver(Cov=Cov, 
@@ -69,7 +86,10 @@ def main(args):
                 gamma=args.gamma,
                 budget=args.budget,
                 asset_limit=args.asset_limit,
-                sampler_method=args.sampler)
+                sampler_method=args.sampler,
+                cache=cache,
+                spectrum=args.spectrum,
+                circuit_cache=CircuitCache() if args.backend != "numpy" else None)
 
     ansatz = TwoLocal(num_qubits=ils.vqe.num_qubits, 
                                     rotation_blocks=['ry','rz'], 
@@ -79,20 +99,45 @@ def main(args):
 
     ils.compute_seq(args.N, ansatz.num_parameters_settable)
 
-    opt = COBYLA(maxiter=args.maxiter, tol=0.1)  
-
-    ils_data = ils.solve(ansatz= ansatz,
-                opt= opt,
-                qi= qi)
-
-    print("ILS (COBYLA): ", min([np.min(data["values"]) for data in ils_data]))
+    if args.optimizer == "L_BFGS_B":
+        opt = L_BFGS_B(maxiter=args.maxiter)
+    elif args.optimizer == "SLSQP":
+        opt = SLSQP(maxiter=args.maxiter)
+    else:
+        opt = COBYLA(maxiter=args.maxiter, tol=0.1)  
+
+    if args.racing:
+        ils_data = ils.race(ansatz= ansatz,
+                    opt= opt,
+                    qi= qi,
+                    backend= "numpy" if args.backend == "numpy" else "qiskit",
+                    gradient= args.gradient,
+                    keep= args.keep,
+                    round_evals= args.round_evals,
+                    deadline= args.deadline,
+                    seed= args.seed)
+    else:
+        ils_data = ils.solve(ansatz= ansatz,
+                    opt= opt,
+                    qi= qi,
+                    backend= "numpy" if args.backend == "numpy" else "qiskit",
+                    gradient= args.gradient,
+                    num_workers= args.num_workers,
+                    seed= args.seed)
+    ils_data = [data for data in ils_data if len(data["values"]) > 0]
+
+    print("ILS ({}): ".format(args.optimizer), min([np.min(data["values"]) for data in ils_data]))
+    if cache is not None:
+        print("Cache: {}".format(cache.cache_info()))
+    if ils.circuit_cache is not None:
+        print("Circuit cache: {}".format(ils.circuit_cache.cache_info()))
     ils_Err = [np.abs(1 - np.min(data["values"])/cvxpy) for data in ils_data]
 
     # Plot Cost function
     fig = plt.figure(figsize=(12,7))
     ax1 = fig.add_subplot(121)
     ax2 = fig.add_subplot(122)
-    for n in range(ils.samples.shape[0]):
+    for n in range(len(ils_data)):
         ax1.plot(ils_data[n]['counts'], ils_data[n]['values'])
     ax1.hlines(cvxpy, ils_data[0]['counts'][0], ils_data[0]['counts'][-1], label="MOSEK Optimum", color="black")
     ax1.set_xlabel('Eval count')
@@ -114,25 +159,40 @@ if __name__ == "__main__":
     parser.add_argument("--time_period", type=int, default=256)
     parser.add_argument("--data_method", type=str, default="brownian_motion", choices=["brownian_motion", "random", "load"])
     parser.add_argument("--data_path", type=str, default="datasets/data.csv")
+    parser.add_argument("--assets", type=str, nargs="*", default=None)
+    parser.add_argument("--float32", action="store_true")
 
     # Portfolio Optimization parameters
     parser.add_argument("--gamma", type=float, default=2)
     parser.add_argument("--budget", type=float, default=100)
     parser.add_argument("--asset_limit", type=float, default=1.0)
+    parser.add_argument("--qp_solver", type=str, default="cvxpy", choices=["cvxpy", "numpy"])
+
+    # Artifact cache
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--cache_size", type=int, default=1024, help="Maximum size of the cache in MB")
 
     # Benchmark parameters
     parser.add_argument("--N", type=int, default=8)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--racing", action="store_true", help="Successive halving over the starting points")
+    parser.add_argument("--keep", type=float, default=0.5, help="Fraction of the starting points kept after each round")
+    parser.add_argument("--round_evals", type=int, default=25, help="Evaluations of each starting point in the first round")
+    parser.add_argument("--deadline", type=float, default=None, help="Wall-clock time limit of the racing in seconds")
 
     # Quantum Solver parameters
     parser.add_argument("--maxiter", type=int, default=200)
+    parser.add_argument("--optimizer", type=str, default="COBYLA", choices=["COBYLA", "L_BFGS_B", "SLSQP"])
+    parser.add_argument("--gradient", type=str, default=None, choices=["adjoint", "parameter_shift"])
     parser.add_argument("--rep", type=int, default=1)
     parser.add_argument("--sampler", type=str, default="random", choices=["sobol", "random"])
+    parser.add_argument("--spectrum", action="store_true", help="Precompute the diagonal energy spectrum of the Hamiltonian")
 
     # Quantum Instance
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--shots", type=int, default=1024)
     parser.add_argument("--backend_name", type=str, default="aer_simulator")
-    parser.add_argument("--backend", type=str, default="simulator", choices=["GPU", "IBMQ", "simulator"])
+    parser.add_argument("--backend", type=str, default="simulator", choices=["GPU", "IBMQ", "simulator", "numpy"])
     parser.add_argument("--hub", type=str, default='ibm-q')
     parser.add_argument("--group", type=str, default='open')
     parser.add_argument("--project", type=str, default='main')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Check that the NumPy and qiskit Ising formulations of the portfolio problem agree, and that the
+spectrum follows the Hamiltonian it is computed for. """
+
+from argparse import ArgumentParser
+import itertools
+import sys
+
+import numpy as np
+
+from solver.vqe.vqe_solver import VQESolver
+from data_factory.utils import randcovmat
+
+def compare(Cov, mu, gamma, budget, asset_limit):
+    """Return the largest relative differences of the energies and offsets of both methods."""
+
+    solvers = {}
+    for method in ["numpy", "qiskit"]:
+        vqe = VQESolver()
+        vqe.qp(Cov=Cov, mu=mu, gamma=gamma, budget=budget, asset_limit=asset_limit)
+        vqe.to_ising(method=method)
+        solvers[method] = vqe
+
+    numpy, qiskit = solvers["numpy"], solvers["qiskit"]
+    if numpy.num_qubits != qiskit.num_qubits:
+        return {"num_qubits": np.inf}
+
+    # Diagonal of the operators, which are made of Z terms only
+    energies = {method: np.real(vqe.H.to_matrix().diagonal()) + vqe.offset for method, vqe in solvers.items()}
+    scale = np.max(np.abs(energies["qiskit"]))
+    return {
+        "energies": np.max(np.abs(energies["numpy"] - energies["qiskit"])) / scale,
+        "offset": abs(numpy.offset - qiskit.offset) / abs(qiskit.offset),
+        }
+
+def check_assigned_hamiltonian(Cov, mu, gamma, budget, asset_limit):
+    """Return the largest relative difference between the spectrum and the diagonal of a Hamiltonian assigned after to_ising."""
+
+    vqe = VQESolver()
+    vqe.qp(Cov=Cov, mu=mu, gamma=gamma, budget=budget, asset_limit=asset_limit)
+    vqe.to_ising()
+    vqe.spectrum()
+
+    # Another Hamiltonian on the same qubits, the spectrum should follow it
+    vqe.H = (-0.5) * vqe.H
+    diagonal = np.real(vqe.H.to_matrix().diagonal())
+    return np.max(np.abs(vqe.spectrum() - diagonal)) / np.max(np.abs(diagonal))
+
+def main(args):
+
+    rng = np.random.default_rng(args.seed)
+    failures = 0
+    for N, gamma, budget, asset_limit in itertools.product(args.num_assets, args.gamma, args.budget, args.asset_limit):
+        # The qiskit converters need an integer range for the continuous variables
+        if asset_limit * budget != round(asset_limit * budget):
+            continue
+
+        Cov = randcovmat(N, rng=rng)
+        mu = rng.uniform(size=N)
+        errors = compare(Cov, mu, gamma, budget, asset_limit)
+        ok = all(err <= args.rtol for err in errors.values())
+        failures += not ok
+        print("{} N={} gamma={} budget={} asset_limit={}: {}".format("OK  " if ok else "FAIL", N, gamma, budget, asset_limit,
+                ", ".join("{} {:.1e}".format(name, err) for name, err in errors.items())))
+
+        err = check_assigned_hamiltonian(Cov, mu, gamma, budget, asset_limit)
+        ok = err <= args.rtol
+        failures += not ok
+        print("{} N={} gamma={} budget={} asset_limit={}: spectrum of an assigned H {:.1e}".format("OK  " if ok else "FAIL",
+                N, gamma, budget, asset_limit, err))
+
+    print("{} failure(s)".format(failures))
+    return failures
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--num_assets", type=int, nargs="*", default=[2, 3])
+    parser.add_argument("--gamma", type=float, nargs="*", default=[0.1, 2])
+    parser.add_argument("--budget", type=float, nargs="*", default=[3, 6, 10])
+    parser.add_argument("--asset_limit", type=float, nargs="*", default=[1.0, 0.5])
+    parser.add_argument("--rtol", type=float, default=1e-10)
+    parser.add_argument("--seed", type=int, default=42)
+
+    args = parser.parse_args()
+    sys.exit(1 if main(args) else 0)
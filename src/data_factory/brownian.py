@@ -15,6 +15,7 @@ from typing import Optional
 
 import numpy as np
 from numpy import ndarray
+from numpy.random import Generator
 
 from scipy.stats import random_correlation
 from sympy import init_printing
@@ -28,6 +29,9 @@ class Brownian():
         correlations: Optional[ndarray] = None,
         init_prices: Optional[ndarray] = None,
         volatilities: Optional[ndarray] = None,
+        num_factors: Optional[int] = None,
+        loadings: Optional[ndarray] = None,
+        rng: Optional[Generator] = None,
         ) -> None:
         """
         Init class
@@ -36,6 +40,9 @@ class Brownian():
             correlations: Correlation matrix
             init_prices: Initial prices
             volatilities: Volatilities
+            num_factors: Number of factors of the random correlation structure. If None a dense correlation matrix is drawn.
+            loadings: Factor loadings of shape (N, K) with rows of norm below one. Used instead of correlations.
+            rng: Random number generator. If None a generator is seeded with fresh entropy.
         """
         
         # Get parameters
@@ -47,25 +54,74 @@ class Brownian():
         else:
             self.R = None
 
+        self.num_factors = num_factors
+        self.B = loadings
+        if isinstance(self.B, ndarray):
+            self.D = 1 - np.sum(self.B**2, axis=1)
+            if np.any(self.D < 0):
+                raise ValueError("Rows of the loadings should have a norm lower than one.")
+        else:
+            self.D = None
+
         self.init_prices = init_prices
         self.volatilities = volatilities
 
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+
     
     def rand_corr(self) -> None:
         """
-        Generate a random correlation matrix and its cholesky decomposition
+        Generate a random correlation matrix and its cholesky decomposition.
+        If num_factors is set, generate random factor loadings instead.
         """
 
+        if self.num_factors is not None:
+            self.rand_factors()
+            return
+
         # Generate a random correlation matrix from random eigenvalues
-        rng = np.random.default_rng()
-        tmp_eigs = np.abs(np.random.rand(self.num_assets))
+        tmp_eigs = np.abs(self.rng.random(self.num_assets))
         eigs = self.num_assets * tmp_eigs / np.sum(tmp_eigs)
 
-        self.Corr = random_correlation.rvs(eigs, random_state=rng)
+        self.Corr = random_correlation.rvs(eigs, random_state=self.rng)
 
         # Perform Cholesky decomposition on correlation matrix
         self.R = np.linalg.cholesky(self.Corr)
 
+    def rand_factors(self,
+        low: float = 0.1,
+        high: float = 0.9,
+        ) -> None:
+        """
+        Generate random factor loadings B and idiosyncratic variances D such that the
+        correlation matrix is B B^T + diag(D). The dense matrix is never formed.
+        Args:
+            low: Lower bound of the share of variance explained by the factors
+            high: Upper bound of the share of variance explained by the factors
+        """
+
+        # Random directions in factor space scaled to a random explained variance
+        B = self.rng.standard_normal((self.num_assets, self.num_factors))
+        B /= np.linalg.norm(B, axis=1, keepdims=True)
+        h = self.rng.uniform(low, high, self.num_assets)
+
+        self.B = B * np.sqrt(h)[:, None]
+        self.D = 1 - h
+
+    def correlation(self) -> ndarray:
+        """
+        Returns the dense correlation matrix.
+        """
+
+        if self.B is not None:
+            Corr = self.B @ self.B.T
+            Corr[np.diag_indices(self.num_assets)] += self.D
+            return Corr
+
+        return self.Corr
+
     def generate_prices(self,
         T: int = 256,
         r: float = 0.001,
@@ -73,7 +129,8 @@ class Brownian():
         low: Optional[int] = 50,
         high: Optional[int] = 400,
         volatilities_mu: Optional[float] = 0.15,
-        volatilities_stddv: Optional[float] = 0.05
+        volatilities_stddv: Optional[float] = 0.05,
+        num_scenarios: Optional[int] = None,
         ) -> ndarray:
         """
         Generate prices for a Brownian motion
@@ -83,36 +140,146 @@ class Brownian():
             dt: Time increment (annualized)
             low: Lower bound initial stock prices
             high: Upper bound initial stock prices
+            volatilities_mu: Mean of the random volatilities
+            volatilities_stddv: Standard deviation of the random volatilities
+            num_scenarios: Number of independent scenarios. If None a single (N, T) path is returned.
+        Returns:
+            Prices of shape (N, T), or (S, N, T) if num_scenarios is given.
+        """
+
+        init_prices = self._init_parameters(low, high, volatilities_mu, volatilities_stddv)
+
+        S = 1 if num_scenarios is None else num_scenarios
+        log_prices = np.empty((S, self.num_assets, T))
+        log_prices[:, :, 0] = np.log(init_prices)
+
+        # Cumulate the log increments of every scenario at once
+        np.cumsum(self._log_increments(T - 1, S, r, dt), axis=2, out=log_prices[:, :, 1:])
+        log_prices[:, :, 1:] += log_prices[:, :, :1]
+        stock_prices = np.exp(log_prices, out=log_prices)
+
+        if num_scenarios is None:
+            return stock_prices[0]
+        return stock_prices
+
+    def write_prices(self,
+        path: str,
+        T: int = 256,
+        num_scenarios: int = 1,
+        chunk_size: int = 64,
+        chunk_axis: str = "scenario",
+        r: float = 0.001,
+        dt: float = 0.004,
+        low: Optional[int] = 50,
+        high: Optional[int] = 400,
+        volatilities_mu: Optional[float] = 0.15,
+        volatilities_stddv: Optional[float] = 0.05,
+        ) -> np.memmap:
+        """
+        Generate scenarios chunk by chunk straight into a memory-mapped .npy file of shape (S, N, T).
+        Peak memory is held to one chunk.
+        Args:
+            path: Path of the .npy file
+            T: Number of simulated days
+            num_scenarios: Number of independent scenarios
+            chunk_size: Number of scenarios (or days) generated per chunk
+            chunk_axis: Axis along which the scenarios are chunked, "scenario" or "time"
+            r : Risk free rate (annual)
+            dt: Time increment (annualized)
+            low: Lower bound initial stock prices
+            high: Upper bound initial stock prices
+            volatilities_mu: Mean of the random volatilities
+            volatilities_stddv: Standard deviation of the random volatilities
+        Returns:
+            Read-only memory map of the generated prices.
+        """
+
+        __available_axis = ["scenario", "time"]
+
+        if chunk_axis not in __available_axis:
+            raise ValueError(f"chunk_axis should be one of {__available_axis}")
+
+        init_prices = self._init_parameters(low, high, volatilities_mu, volatilities_stddv)
+        prices = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(num_scenarios, self.num_assets, T))
+
+        if chunk_axis == "scenario":
+            for s in range(0, num_scenarios, chunk_size):
+                S = min(chunk_size, num_scenarios - s)
+                chunk = np.empty((S, self.num_assets, T))
+                chunk[:, :, 0] = np.log(init_prices)
+                np.cumsum(self._log_increments(T - 1, S, r, dt), axis=2, out=chunk[:, :, 1:])
+                chunk[:, :, 1:] += chunk[:, :, :1]
+                prices[s:s+S] = np.exp(chunk, out=chunk)
+
+        elif chunk_axis == "time":
+            # Carry the last log prices of every scenario from one chunk to the next
+            last = np.broadcast_to(np.log(init_prices, dtype=np.float64)[:, None], (num_scenarios, self.num_assets, 1))
+            prices[:, :, 0] = np.exp(last[:, :, 0])
+            for t in range(1, T, chunk_size):
+                steps = min(chunk_size, T - t)
+                chunk = np.cumsum(self._log_increments(steps, num_scenarios, r, dt), axis=2)
+                chunk += last
+                last = chunk[:, :, -1:].copy()
+                prices[:, :, t:t+steps] = np.exp(chunk, out=chunk)
+
+        prices.flush()
+        del prices
+
+        return np.load(path, mmap_mode="r")
+
+    def _init_parameters(self,
+        low: int,
+        high: int,
+        volatilities_mu: float,
+        volatilities_stddv: float,
+        ) -> ndarray:
+        """
+        Draw the missing parameters (initial prices, volatilities, correlations)
+        Returns:
+            Initial prices.
         """
 
         # Test if initial parameters are given. Otherwise generate random parameters
         if isinstance(self.init_prices, ndarray):
-            stock_prices = np.array([[s]*T for s in self.init_prices])
+            init_prices = self.init_prices
         else:
-            init_prices = np.random.randint(low=low, high=high, size=(self.num_assets,))
-            stock_prices = np.array([[s]*T for s in init_prices])
+            init_prices = self.rng.integers(low=low, high=high, size=(self.num_assets,))
 
         if self.volatilities is None:
-            self.volatilities = np.random.normal(volatilities_mu, volatilities_stddv, self.num_assets)
+            self.volatilities = self.rng.normal(volatilities_mu, volatilities_stddv, self.num_assets)
 
-        if self.R is None:
+        if self.R is None and self.B is None:
             self.rand_corr()
 
-        for t in range(1, T):
-            # Generate array of random standard normal draws
-            random_array = np.random.standard_normal(self.num_assets)
-            
-            # Multiply R with random_array to obtain correlated epsilons
-            epsilon_array = np.inner(random_array, self.R)
-
-            # Sample price path per stock
-            for n in range(self.num_assets):
-                dt = 1 / T 
-                S = stock_prices[n,t-1]
-                v = self.volatilities[n]
-                epsilon = epsilon_array[n]
-                
-                # Generate new stock price
-                stock_prices[n,t] = S * np.exp((r - 0.5 * v**2) * dt + v * np.sqrt(dt) * epsilon)
-
-        return stock_prices.reshape(self.num_assets, T)
\ No newline at end of file
+        return init_prices
+
+    def _log_increments(self,
+        num_steps: int,
+        num_scenarios: int,
+        r: float,
+        dt: float,
+        ) -> ndarray:
+        """
+        Draw the correlated log-price increments of the Brownian motion
+        Args:
+            num_steps: Number of time steps
+            num_scenarios: Number of independent scenarios
+            r : Risk free rate (annual)
+            dt: Time increment (annualized)
+        Returns:
+            Log increments of shape (S, N, num_steps).
+        """
+
+        # Draw all the standard normal draws in one call and correlate them with R
+        # or, for a factor structure, through the factor loadings
+        if self.B is not None:
+            factor_array = self.rng.standard_normal((num_scenarios, num_steps, self.B.shape[1]))
+            epsilon = factor_array @ self.B.T
+            epsilon += np.sqrt(self.D) * self.rng.standard_normal((num_scenarios, num_steps, self.num_assets))
+        else:
+            random_array = self.rng.standard_normal((num_scenarios, num_steps, self.num_assets))
+            epsilon = random_array @ self.R.T
+
+        v = self.volatilities
+        increments = (r - 0.5 * v**2) * dt + v * np.sqrt(dt) * epsilon
+        return increments.transpose(0, 2, 1)
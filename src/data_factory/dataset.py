@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Parallel and reproducible generation of multi-market datasets. """
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+from numpy.random import SeedSequence
+
+from data_factory.utils import rand_data
+
+def generate_markets(path: str,
+    num_markets: int,
+    N: int,
+    T: int,
+    seed: Optional[int] = None,
+    method: str = "brownian_motion",
+    num_workers: int = 1,
+    freq: Optional[str] = "D",
+    init_date: Optional[str] = '2021-01-01',
+    low: Optional[int] = 50,
+    high: Optional[int] = 400,
+    num_factors: Optional[int] = None,
+    ) -> Dict:
+    """
+    Generate market instances in parallel and write them with their metadata to a compressed archive.
+    Every instance draws from its own stream spawned from the root seed, so the archive is
+    bit-identical for any number of workers.
+    Args:
+        path: path of the .npz archive
+        num_markets: number of market instances
+        N: number of assets
+        T: number of time steps
+        seed: root seed. If None fresh entropy is drawn and recorded in the metadata.
+        method: method to generate random data
+        num_workers: number of worker processes
+        freq: frequency of dates
+        init_date: initial date
+        low: lower bound initial sotck prices
+        high: upper bound initial sotck prices
+        num_factors: number of factors of the correlation structure (None for a dense correlation matrix)
+    Returns:
+        metadata: metadata written to the archive
+    """
+
+    root = SeedSequence(seed)
+    streams = root.spawn(num_markets)
+
+    generate = partial(_generate_market,
+                N= N,
+                T= T,
+                method= method,
+                freq= freq,
+                init_date= init_date,
+                low= low,
+                high= high,
+                num_factors= num_factors)
+
+    X = np.empty((num_markets, N, T))
+    if num_workers == 1:
+        for m, stream in enumerate(streams):
+            X[m] = generate(stream)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunksize = max(1, num_markets // (4 * num_workers))
+            for m, x in enumerate(executor.map(generate, streams, chunksize=chunksize)):
+                X[m] = x
+
+    metadata = {
+        "num_markets": num_markets,
+        "N": N,
+        "T": T,
+        "entropy": str(root.entropy),
+        "method": method,
+        "freq": freq,
+        "init_date": init_date,
+        "low": low,
+        "high": high,
+        "num_factors": num_factors,
+        }
+
+    np.savez_compressed(path, X=X, metadata=json.dumps(metadata))
+
+    return metadata
+
+def load_markets(path: str) -> Tuple[ndarray, Dict]:
+    """
+    Load market instances written by generate_markets
+    Args:
+        path: path of the .npz archive
+    Returns:
+        X: prices of shape (num_markets, N, T)
+        metadata: metadata of the dataset
+    """
+
+    with np.load(path) as archive:
+        X = archive["X"]
+        metadata = json.loads(str(archive["metadata"]))
+
+    return X, metadata
+
+def _generate_market(stream: SeedSequence, N: int, T: int, **kwargs) -> ndarray:
+
+    rng = np.random.default_rng(stream)
+    df = rand_data(N, T, rng=rng, **kwargs)
+    return df.values.T
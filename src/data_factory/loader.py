@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Bulk loading of price files. """
+
+import hashlib
+import json
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+from numpy import ndarray
+
+import pandas as pd
+from pandas import DataFrame
+
+def load_prices(path: str,
+    assets: Optional[List[str]] = None,
+    dtype: Union[str, type] = np.float64,
+    cache: bool = True,
+    ) -> Union[ndarray, DataFrame]:
+    """
+    Load a wide price file to be handed to Market without copying the prices.
+    Tables (.csv, .parquet) hold dates in rows and assets in columns, .npy files are of shape (N, T).
+    Parsed CSV files are cached next to the source as a .npy file that is memory-mapped by later calls.
+    Args:
+        path: path of the .csv, .parquet or .npy file
+        assets: assets (column names, or row indices for .npy files) to load. All assets if None.
+        dtype: dtype of the prices, e.g. np.float32 to halve the memory
+        cache: whether to use and write the binary cache of CSV files
+    Returns:
+        DataFrame of prices with dates, or memory-mapped array of shape (N, T) for .npy files
+    """
+
+    __available_formats = [".csv", ".parquet", ".npy"]
+
+    ext = os.path.splitext(path)[1]
+    if ext not in __available_formats:
+        raise ValueError(f"file format should be one of {__available_formats}")
+
+    if ext == ".npy":
+        X = np.load(path, mmap_mode="r")
+        if assets is not None:
+            X = X[[int(a) for a in assets]]
+        if X.dtype != np.dtype(dtype):
+            X = X.astype(dtype)
+        return X
+
+    if ext == ".parquet":
+        df = pd.read_parquet(path, columns=assets)
+        return df.astype(dtype, copy=False)
+
+    if cache:
+        values_path, meta_path = _cache_paths(path, assets, dtype)
+        df = _read_cache(path, values_path, meta_path)
+        if df is not None:
+            return df
+
+    # Project the columns while parsing
+    usecols = None
+    if assets is not None:
+        index_col = pd.read_csv(path, nrows=0).columns[0]
+        usecols = [index_col] + list(assets)
+    df = pd.read_csv(path, index_col=0, usecols=usecols, parse_dates=True, dtype={a: dtype for a in assets or []})
+    if assets is not None:
+        df = df[list(assets)]
+    df = df.astype(dtype, copy=False)
+
+    if cache:
+        _write_cache(path, values_path, meta_path, df)
+        df = _read_cache(path, values_path, meta_path)
+
+    return df
+
+def _cache_paths(path: str, assets: Optional[List[str]], dtype: Union[str, type]):
+
+    key = hashlib.sha1(json.dumps([assets, np.dtype(dtype).str]).encode()).hexdigest()[:12]
+    return f"{path}.{key}.npy", f"{path}.{key}.json"
+
+def _read_cache(path: str, values_path: str, meta_path: str) -> Optional[DataFrame]:
+    """Open the cache of a CSV file if it is up to date, without copying the prices."""
+
+    if not (os.path.exists(values_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(path)
+    if meta["mtime"] != stat.st_mtime or meta["size"] != stat.st_size:
+        return None
+
+    # Prices are stored as (N, T) so that Market.X is a view of the memory map
+    X = np.load(values_path, mmap_mode="r")
+    index = pd.to_datetime(meta["index"]) if meta["dates"] else pd.Index(meta["index"])
+    return DataFrame(X.T, index=index, columns=meta["columns"], copy=False)
+
+def _write_cache(path: str, values_path: str, meta_path: str, df: DataFrame) -> None:
+
+    stat = os.stat(path)
+    dates = isinstance(df.index, pd.DatetimeIndex)
+    meta = {
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "columns": [str(c) for c in df.columns],
+        "dates": dates,
+        "index": [str(i) for i in df.index] if dates else df.index.tolist(),
+        }
+
+    np.save(values_path, np.ascontiguousarray(df.values.T))
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
@@ -10,11 +10,15 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-from typing import Optional, List, Union, Callable
+from collections import OrderedDict
+import os
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple, Union, Callable
 
 import numpy as np
 from numpy import ndarray
+from scipy.linalg import eigh
 
+import pandas as pd
 from pandas import DataFrame
 
 from data_factory.utils import mean_forcast_return
@@ -25,7 +29,16 @@ class Market():
     def __init__(self,
         data: Union[ndarray, DataFrame],
         forcast_return: Callable = mean_forcast_return,
+        decay: float = 1.0,
+        cache_size: int = 8,
         ) -> None:
+        """
+        Args:
+            data: Prices of shape (N, T) or DataFrame of shape (T, N) indexed by dates.
+            forcast_return: Function computing the forcast return.
+            decay: Exponential decay applied to past observations by the online statistics (1 = no decay).
+            cache_size: Maximum number of time ranges whose covariance matrix is cached (0 disables the cache).
+        """
 
         # Get parameters
         if isinstance(data, ndarray):
@@ -39,8 +52,216 @@ class Market():
             self.N = data.shape[1]
             self.T = data.shape[0]
 
-        self.Cov = self.cov() # Total covariance matrix
-        self.mu = self.forcast_return(forcast_return= forcast_return) # Total forcast return
+        self._init_state(forcast_return, decay, cache_size)
+
+        self._push(self.X)
+        self.Cov = self._stats_cov() # Total covariance matrix
+        self.mu = self._stats_forcast_return() # Total forcast return
+        self._cache_stats_cov()
+
+    @classmethod
+    def from_chunks(cls,
+        source: Union[str, Iterable[Union[ndarray, DataFrame]]],
+        chunk_size: int = 4096,
+        forcast_return: Callable = mean_forcast_return,
+        decay: float = 1.0,
+        cache_size: int = 8,
+        ) -> "Market":
+        """Build a market from a chunked source in a single streaming pass with bounded memory.
+        Only a memory-mapped .npy source keeps the prices available for cov() and forcast_return()
+        on other time ranges. The other sources only keep the online statistics.
+        Args:
+            source: Path of a .npy file of shape (N, T), directory of .csv/.parquet/.npy shards
+                in chronological order, or iterable of blocks of shape (N, t) or DataFrames of shape (t, N).
+            chunk_size: Number of time steps read at once from a .npy file.
+            forcast_return: Function computing the forcast return.
+            decay: Exponential decay applied to past observations by the online statistics (1 = no decay).
+            cache_size: Maximum number of time ranges whose covariance matrix is cached (0 disables the cache).
+        Returns:
+            market: Market with its covariance matrix and forcast return.
+        """
+
+        market = cls.__new__(cls)
+        market.df = None
+        market.X = None
+        market.T = 0
+
+        if isinstance(source, str) and os.path.isfile(source):
+            market.X = np.load(source, mmap_mode="r")
+            blocks = (market.X[:, t:t+chunk_size] for t in range(0, market.X.shape[1], chunk_size))
+        elif isinstance(source, str):
+            blocks = _read_shards(source)
+        else:
+            blocks = source
+
+        for block in blocks:
+            if isinstance(block, DataFrame):
+                block = block.values.T
+            if market.T == 0:
+                market.N = block.shape[0]
+                market._init_state(forcast_return, decay, cache_size)
+            market._push(block)
+            market.T += block.shape[1]
+
+        if market.T == 0:
+            raise ValueError("source does not contain any observation.")
+
+        market.Cov = market._stats_cov()
+        market.mu = market._stats_forcast_return()
+        market._cache_stats_cov()
+        return market
+
+    def append(self,
+        x: ndarray,
+        index: Optional[pd.Index] = None,
+        ) -> None:
+        """Append new observations and update Cov and mu online in O(N^2) per observation.
+        Args:
+            x: New prices of shape (N,) or (N, k).
+            index: Dates of the new observations, required if the market holds a DataFrame.
+        """
+
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 1:
+            x = x[:, None]
+        k = x.shape[1]
+
+        # The rows are kept in the price buffer, the DataFrame is only extended when it is read
+        if self._df is not None:
+            if index is None or len(index) != k:
+                raise ValueError("index with one date per observation is required to append to a DataFrame.")
+            self._pending.append(pd.Index(index))
+
+        # Grow the price buffer geometrically so that appending is amortized O(N)
+        if self.X is not None:
+            if self._buffer is None or self.T + k > self._buffer.shape[1]:
+                buffer = np.empty((self.N, 2 * (self.T + k)), dtype=np.result_type(self.X.dtype, float))
+                buffer[:, :self.T] = self.X
+                self._buffer = buffer
+            self._buffer[:, self.T:self.T+k] = x
+            self.X = self._buffer[:, :self.T+k]
+        self.T += k
+
+        self._push(x)
+        self.Cov = self._stats_cov()
+        self.mu = self._stats_forcast_return()
+        self._cache_stats_cov()
+
+    @property
+    def df(self) -> Optional[DataFrame]:
+        """DataFrame of the prices (None if the market was not built from one), with the appended rows."""
+
+        if self._pending:
+            index = self._pending[0].append(self._pending[1:]) if len(self._pending) > 1 else self._pending[0]
+            rows = DataFrame(self.X[:, self.T - len(index):].T, index=index, columns=self._df.columns)
+            self._df = pd.concat([self._df, rows])
+            self._pending = []
+        return self._df
+
+    @df.setter
+    def df(self, value: Optional[DataFrame]) -> None:
+        self._df = value
+        self._pending = []
+
+    def _init_state(self,
+        forcast_return: Callable,
+        decay: float,
+        cache_size: int,
+        ) -> None:
+        """Initialize the online statistics and the covariance cache."""
+
+        self.decay = decay
+        self._forcast_return = forcast_return
+        self._buffer = None
+        self._pending = []
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        self._W = 0.0
+        self._W2 = 0.0
+        self._mean = np.zeros(self.N)
+        self._C = np.zeros((self.N, self.N))
+        self._newest = None
+        self._last = None
+
+    def _push(self, x: ndarray) -> None:
+        """Push new observations into the online statistics.
+        The statistics lag one observation behind, as cov() excludes the last time step by default.
+        Args:
+            x: Observations of shape (N, k), oldest first.
+        """
+
+        if self._last is None:
+            Y = x[:, :-1]
+        else:
+            Y = np.concatenate([self._last[:, None], x[:, :-1]], axis=1)
+        self._last = np.array(x[:, -1], dtype=float)
+
+        if Y.shape[1] > 0:
+            self._update_stats(Y)
+            self._newest = np.array(Y[:, -1], dtype=float)
+
+    def _update_stats(self, Y: ndarray) -> None:
+        """Merge a block of observations into the online statistics (weighted Welford/Chan update).
+        Args:
+            Y: Observations of shape (N, k), oldest first.
+        """
+
+        k = Y.shape[1]
+        w = self.decay ** np.arange(k - 1, -1, -1, dtype=float)
+
+        # Age the current statistics
+        W_a = self._W * self.decay**k
+        self._W2 = self._W2 * self.decay**(2 * k) + np.sum(w**2)
+        self._C *= self.decay**k
+
+        # Statistics of the new block
+        W_b = np.sum(w)
+        mean_b = Y @ w / W_b
+        Yc = Y - mean_b[:, None]
+
+        delta = mean_b - self._mean
+        self._W = W_a + W_b
+        self._mean += delta * W_b / self._W
+        self._C += (Yc * w) @ Yc.T + np.outer(delta, delta) * W_a * W_b / self._W
+
+    def _stats_cov(self) -> ndarray:
+        """Covariance matrix from the online statistics (unbiased for reliability weights)."""
+
+        return self._C / (self._W - self._W2 / self._W)
+
+    def _stats_forcast_return(self) -> ndarray:
+        """Forcast return from the online statistics. Other forcast functions than the mean one are recomputed."""
+
+        if self._forcast_return is mean_forcast_return:
+            return self._newest / self._mean
+        if self.X is None:
+            raise ValueError("Only the mean forcast return can be computed without the prices.")
+        return self.forcast_return(forcast_return= self._forcast_return)
+
+    @classmethod
+    def from_npy(cls,
+        path: str,
+        scenario: Optional[int] = 0,
+        forcast_return: Callable = mean_forcast_return,
+        ) -> "Market":
+        """Open a market from a memory-mapped .npy file without copying it.
+        Args:
+            path: Path of a .npy file of shape (N, T) or (S, N, T).
+            scenario: Scenario to select if the file holds several scenarios.
+            forcast_return: Function computing the forcast return.
+        Returns:
+            market: Market backed by the memory map.
+        """
+
+        X = np.load(path, mmap_mode="r")
+        if X.ndim == 3:
+            X = X[scenario]
+
+        return cls(X, forcast_return=forcast_return)
 
     def cov(self,
         assets: Optional[List] = None,
@@ -56,24 +277,64 @@ class Market():
             Cov: Covariance matrix.
         """
 
-        # If no assets is specified, compute covariance matrix for all assets
+        # Resolve the time range so that it keys the cache
+        Ti, Tf, _ = slice(self._get_loc(Ti, "Ti"), self._get_loc(Tf, "Tf")).indices(self.T)
+
+        # Covariance matrices of all assets are cached per time range, subsets are slices of them
+        key = (Ti, Tf)
+        if key in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            Cov = self._cache[key]
+        else:
+            if self.X is None:
+                raise ValueError("Prices are not available, only the statistics of the default time range are.")
+            self._cache_misses += 1
+            Cov = np.atleast_2d(np.cov(self.X[:, Ti:Tf]))
+            self._cache_put(key, Cov)
+
+        # If no assets is specified, return covariance matrix for all assets
         if assets is None:
-            assets = [i for i in range(self.N)]
+            return Cov.copy()
+        return Cov[np.ix_(assets, assets)]
 
-        # Compute covariance matrix
-        if isinstance(Ti, str):
-            try:
-                Ti = self.df.index.get_loc(Ti)
-            except:
-                raise ValueError("Ti is not a valid date or not Dataframe with dates was provided.")
-        if isinstance(Tf, str):
-            try:
-                Tf = self.df.index.get_loc(Tf)
-            except:
-                raise ValueError("Tf is not a valid date or not Dataframe with dates was provided.")
+    def cache_info(self) -> Dict:
+        """Statistics of the covariance cache.
+        Returns:
+            info: Number of hits, misses, hit rate, number of cached time ranges and their size in bytes.
+        """
+
+        queries = self._cache_hits + self._cache_misses
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "hit_rate": self._cache_hits / queries if queries else 0.0,
+            "size": len(self._cache),
+            "nbytes": sum(Cov.nbytes for Cov in self._cache.values()),
+            }
+
+    def clear_cache(self) -> None:
+        """Empty the covariance cache and reset its statistics."""
+
+        self._cache.clear()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def _cache_put(self, key: Tuple[int, int], Cov: ndarray) -> None:
+        """Insert a covariance matrix in the cache and evict the least recently used ones."""
+
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = Cov
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cache_stats_cov(self) -> None:
+        """Reuse the online covariance matrix for the default time range when it is not decayed."""
 
-        Cov = np.cov(self.X[assets, Ti:Tf])
-        return Cov
+        if self.decay == 1.0:
+            self._cache_put((0, self.T - 1), self.Cov.copy())
 
     def forcast_return(self,
         forcast_return: Callable = mean_forcast_return,
@@ -96,16 +357,156 @@ class Market():
             assets = [i for i in range(self.N)]
 
         # Compute forcast return
-        if isinstance(Ti, str):
-            try:
-                Ti = self.df.index.get_loc(Ti)
-            except:
-                raise ValueError("Ti is not a valid date or not Dataframe with dates was provided.")
-        if isinstance(Tf, str):
+        Ti = self._get_loc(Ti, "Ti")
+        Tf = self._get_loc(Tf, "Tf")
+
+        if self.X is None:
+            # The online statistics hold the mean forcast return of the default time range
+            default = slice(Ti, Tf).indices(self.T)[:2] == (0, self.T - 1)
+            if forcast_return is mean_forcast_return and default and self.decay == 1.0:
+                return self.mu[assets]
+            raise ValueError("Prices are not available, only the mean forcast return of the default time range is.")
+
+        fr = forcast_return(self.X[assets, Ti:Tf]) 
+        return fr
+
+    def factor_model(self,
+        num_factors: int,
+        method: str = "pca",
+        assets: Optional[List] = None,
+        Ti: Optional[Union[int,str]] = 0,
+        Tf: Optional[Union[int,str]] = -1,
+        ) -> Tuple[ndarray, ndarray, ndarray]:
+        """Compute a low-rank factor model of the covariance matrix, Cov ~ B F B^T + diag(D).
+        Args:
+            num_factors: Number of factors K.
+            method: "pca" for the leading eigenvectors of the covariance matrix, "svd" for the
+                leading singular vectors of the centered prices (cheaper when N > T, never forms the N x N matrix).
+            assets: List of assets to compute the factor model for.
+            Ti: Initial time step.
+            Tf: Final time step.
+        Returns:
+            B: Factor loadings of shape (N, K).
+            F: Factor covariance matrix of shape (K, K).
+            D: Idiosyncratic variances of shape (N,).
+        """
+
+        __available_methods = ["pca", "svd"]
+
+        if method not in __available_methods:
+            raise ValueError(f"method should be one of {__available_methods}")
+
+        if method == "pca":
+            Cov = self.cov(assets=assets, Ti=Ti, Tf=Tf)
+            N = Cov.shape[0]
+            eigs, B = eigh(Cov, subset_by_index=[N - num_factors, N - 1])
+            variances = np.diag(Cov)
+
+        elif method == "svd":
+            Ti = self._get_loc(Ti, "Ti")
+            Tf = self._get_loc(Tf, "Tf")
+            X = self.X[:, Ti:Tf] if assets is None else self.X[assets, Ti:Tf]
+            Y = (X - X.mean(axis=1, keepdims=True)) / np.sqrt(X.shape[1] - 1)
+            U, S, _ = np.linalg.svd(Y, full_matrices=False)
+            B = U[:, :num_factors]
+            eigs = S[:num_factors]**2
+            variances = np.sum(Y**2, axis=1)
+
+        F = np.diag(eigs)
+        D = np.maximum(variances - (B**2) @ eigs, 0)
+        return B, F, D
+
+    def rolling_stats(self,
+        windows: Optional[List[Tuple[Union[int,str], Union[int,str]]]] = None,
+        length: Optional[int] = None,
+        stride: int = 1,
+        assets: Optional[List] = None,
+        forcast_return: Callable = mean_forcast_return,
+        ) -> Tuple[ndarray, ndarray]:
+        """Compute covariance matrices and forcast returns for many time windows at once.
+        Prefix sums of X and XX^T are accumulated once on the window boundaries, so that each
+        window costs O(N^2) whatever its length.
+        Args:
+            windows: List of (Ti, Tf) time windows, with the same meaning as in cov().
+            length: Length of rolling windows, used if no windows are specified.
+            stride: Stride between consecutive rolling windows.
+            assets: List of assets to compute the statistics for.
+            forcast_return: Function computing the forcast return.
+        Returns:
+            Cov: Covariance matrices of shape (W, N, N).
+            forcast_return: Forcast returns of shape (W, N).
+        """
+
+        if windows is None:
+            if length is None:
+                raise ValueError("Either windows or length should be specified.")
+            starts = np.arange(0, self.T - length + 1, stride)
+            stops = starts + length
+        else:
+            bounds = [slice(self._get_loc(Ti, "Ti"), self._get_loc(Tf, "Tf")).indices(self.T)[:2] for Ti, Tf in windows]
+            starts, stops = np.array(bounds, dtype=int).reshape(-1, 2).T
+
+        if assets is None:
+            X = self.X
+        else:
+            X = self.X[assets]
+
+        # Prefix sums on the sorted window boundaries, shifted by a reference to limit cancellation
+        boundaries = np.unique(np.concatenate([starts, stops]))
+        ref = X[:, boundaries[0]:boundaries[-1]].mean(axis=1)
+
+        S1 = np.zeros((len(boundaries), X.shape[0]))
+        S2 = np.zeros((len(boundaries), X.shape[0], X.shape[0]))
+        for b in range(1, len(boundaries)):
+            Y = X[:, boundaries[b-1]:boundaries[b]] - ref[:, None]
+            S1[b] = S1[b-1] + Y.sum(axis=1)
+            S2[b] = S2[b-1] + Y @ Y.T
+
+        i = np.searchsorted(boundaries, starts)
+        f = np.searchsorted(boundaries, stops)
+        n = (stops - starts).astype(float)
+
+        mean = (S1[f] - S1[i]) / n[:, None]
+        Cov = (S2[f] - S2[i]) - n[:, None, None] * mean[:, :, None] * mean[:, None, :]
+        Cov /= (n - 1)[:, None, None]
+        mean += ref
+
+        if forcast_return is mean_forcast_return:
+            fr = X[:, stops - 1].T / mean
+        else:
+            fr = np.array([forcast_return(X[:, a:b]) for a, b in zip(starts, stops)])
+
+        return Cov, fr
+
+    def _get_loc(self, t: Union[int,str], name: str) -> int:
+        """Resolve a date into a time step.
+        Args:
+            t: Time step or date.
+            name: Name of the argument for error messages.
+        Returns:
+            t: Time step.
+        """
+
+        if isinstance(t, str):
             try:
-                Tf = self.df.index.get_loc(Tf)
+                t = self.df.index.get_loc(t)
             except:
-                raise ValueError("Tf is not a valid date or not Dataframe with dates was provided.")
+                raise ValueError(f"{name} is not a valid date or not Dataframe with dates was provided.")
+        return t
 
-        fr = forcast_return(self.X[assets, Ti:Tf]) 
-        return fr
\ No newline at end of file
+def _read_shards(path: str) -> Iterator[ndarray]:
+    """Read the .csv/.parquet/.npy shards of a directory one by one, in sorted order.
+    Args:
+        path: Directory of shards. Tables hold dates in rows and assets in columns, .npy files are of shape (N, t).
+    Returns:
+        blocks: Iterator of blocks of shape (N, t).
+    """
+
+    for name in sorted(os.listdir(path)):
+        file = os.path.join(path, name)
+        if name.endswith(".csv"):
+            yield pd.read_csv(file, index_col=0).values.T
+        elif name.endswith(".parquet"):
+            yield pd.read_parquet(file).values.T
+        elif name.endswith(".npy"):
+            yield np.load(file, mmap_mode="r")
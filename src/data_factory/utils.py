@@ -14,26 +14,27 @@ from typing import Optional
 
 import numpy as np
 from numpy import ndarray
+from numpy.random import Generator
 
 import pandas as pd
 from pandas import DataFrame
 
 from data_factory.brownian import Brownian
 
-def randcovmat(N: int, seed: Optional[int]= None)-> ndarray:
+def randcovmat(N: int, seed: Optional[int]= None, rng: Optional[Generator] = None)-> ndarray:
     """
     Generate a random covariant matrix
     Args:
         N: number of assets
         seed: seed for random number generator
+        rng: random number generator, used instead of the seed
     Returns:
         A: random covariant matrix
     """
-    if seed is None:
-        seed = np.random.randint(0, 10000)
-    np.random.seed(seed)
+    if rng is None:
+        rng = _seed_rng(seed)
 
-    A = np.random.rand(N, N)
+    A = rng.random((N, N))
     return A @ A.T
 
 def rand_data(N: int,
@@ -44,6 +45,8 @@ def rand_data(N: int,
     method: str = "random",
     low: Optional[int] = 50,
     high: Optional[int] = 400,
+    num_factors: Optional[int] = None,
+    rng: Optional[Generator] = None,
     ) -> DataFrame:
     """
     Generate random time series with dates
@@ -56,6 +59,8 @@ def rand_data(N: int,
         method: method to generate random data
         low: lower bound initial sotck prices
         high: upper bound initial sotck prices
+        num_factors: number of factors of the correlation structure (None for a dense correlation matrix)
+        rng: random number generator, used instead of the seed
     Returns:
         Dataframe with random time series and dates
     """
@@ -65,17 +70,16 @@ def rand_data(N: int,
     if method not in __available_methods:
         raise ValueError(f"method should be one of {__available_methods}")
 
-    if seed is None:
-        seed = np.random.randint(0, 10000)
-    np.random.seed(seed)
+    if rng is None:
+        rng = _seed_rng(seed)
 
-    rng = pd.date_range(init_date, freq=freq, periods=T)
+    dates = pd.date_range(init_date, freq=freq, periods=T)
 
     if method == "random":
-        X = np.random.rand(N, T)
+        X = rng.random((N, T))
 
     elif method == "brownian_motion":
-        br = Brownian(N)
+        br = Brownian(N, num_factors=num_factors, rng=rng)
         X = br.generate_prices(T= T,
                 r= 0.001,
                 dt= 1.0/T,
@@ -84,10 +88,66 @@ def rand_data(N: int,
 
     df = pd.DataFrame(X.T, 
                   columns=["Asset_" + str(i) for i in range(N)], 
-                  index=rng)
+                  index=dates)
 
     return df
 
+def rand_scenarios(path: str,
+    N: int,
+    T: int,
+    num_scenarios: int,
+    seed: Optional[int] = None,
+    chunk_size: int = 64,
+    chunk_axis: str = "scenario",
+    low: Optional[int] = 50,
+    high: Optional[int] = 400,
+    num_factors: Optional[int] = None,
+    rng: Optional[Generator] = None,
+    ) -> np.memmap:
+    """
+    Generate brownian motion scenarios straight to a memory-mapped .npy file
+    Args:
+        path: path of the .npy file
+        N: number of assets
+        T: number of time steps
+        num_scenarios: number of scenarios
+        seed: seed for random number generator
+        chunk_size: number of scenarios (or time steps) held in memory at once
+        chunk_axis: axis along which the scenarios are chunked, "scenario" or "time"
+        low: lower bound initial sotck prices
+        high: upper bound initial sotck prices
+        num_factors: number of factors of the correlation structure (None for a dense correlation matrix)
+        rng: random number generator, used instead of the seed
+    Returns:
+        Read-only memory map of shape (num_scenarios, N, T)
+    """
+
+    if rng is None:
+        rng = _seed_rng(seed)
+
+    br = Brownian(N, num_factors=num_factors, rng=rng)
+    X = br.write_prices(path,
+            T= T,
+            num_scenarios= num_scenarios,
+            chunk_size= chunk_size,
+            chunk_axis= chunk_axis,
+            r= 0.001,
+            dt= 1.0/T,
+            low= low,
+            high= high)
+
+    return X
+
+def _seed_rng(seed: Optional[int] = None) -> Generator:
+    """
+    Generator of a seed, without touching the global random state
+    Args:
+        seed: seed for random number generator (None for fresh entropy)
+    Returns:
+        rng: random number generator
+    """
+    return np.random.default_rng(seed)
+
 def mean_forcast_return(X: ndarray) -> ndarray:
 
     forcast_return = X[:,-1] / np.mean(X, axis=1)
@@ -16,9 +16,11 @@ from argparse import ArgumentParser
 import numpy as np
 import matplotlib.pyplot as plt
 
-from solver.cvxpy.cvxpy_solver import CVXPYSolver
+from solver.cvxpy.cvxpy_solver import CVXPYFrontier
+from solver.cvxpy.parallel import parallel_frontier
 from data_factory.utils import rand_data
 from data_factory.market import Market
+from data_factory.loader import load_prices
 
 __available_methods = ["random", "brownian_motion", "loading"]
 
@@ -26,9 +28,8 @@ def main(args):
 
     if args.data_method == "brownian_motion" or args.data_method == "random":
         data = rand_data(args.num_assets , args.time_period, method=args.data_method)
-    elif args.data_type == "loading":
-        with open(args.path, 'rb') as f:
-            data = np.load(f)
+    elif args.data_method == "loading":
+        data = load_prices(args.data_path, assets=args.assets, dtype=np.float32 if args.float32 else np.float64)
 
     market = Market(data)
 
@@ -38,28 +39,22 @@ def main(args):
 
     # CVXPY
     gammas = np.logspace(-5, 1, num=50)
-    risk = []
-    ret = []
-    wmax = []
-    for gamma in gammas:
-        __, w = CVXPYSolver(Cov=Cov, mu=mu, gamma=gamma, budget=args.budget, verbose = False)
-        try :
-            risk.append(w.T @ Cov  @ w)
-            ret.append((np.ones(args.num_assets) + mu.T) @ w + args.budget - sum(w))
-            wmax.append(w.max())
-        except:
-            print("CVXPY failed for {}".format(gamma))
-            risk.append(np.nan)
-            ret.append(np.nan)
-            wmax.append(np.nan)
-
-    ret=np.array(ret)
-    risk=np.array(risk)
+    if args.num_workers > 1:
+        res = parallel_frontier(Cov=Cov, mu=mu, gammas=gammas, budget=args.budget, num_workers=args.num_workers)
+    else:
+        frontier = CVXPYFrontier(Cov=Cov, mu=mu, budget=args.budget, verbose=False)
+        res = frontier.solve(gammas)
+    for gamma in gammas[np.isnan(res["risk"])]:
+        print("CVXPY failed for {}".format(gamma))
+
+    ret = res["returns"]
+    risk = res["risk"]
+    wmax = np.max(res["weights"], axis=1)
 
     # Plot simulated price paths
     fig, ax = plt.subplots(figsize=(10, 8))
-    array_day_plot = [t for t in range(args.time_period)]
-    for n in range(args.num_assets):
+    array_day_plot = [t for t in range(market.T)]
+    for n in range(market.N):
         ax.plot(array_day_plot, market.X[n], label="Asset {}".format(n))
     plt.grid()
     plt.xlabel('Day')
@@ -73,7 +68,7 @@ def main(args):
     ax.hlines(y=args.budget, xmin=gammas.min(), xmax=gammas.max() ,color='r', linestyle='-', label='Budget')
     ax.set_xlabel('Risk aversion (gamma)')
     ax.legend()
-    ax.set_title("MOSEK with num assets = {} and budget = {}".format(args.num_assets, args.budget))
+    ax.set_title("MOSEK with num assets = {} and budget = {}".format(market.N, args.budget))
     ax.set_yscale('log')
     plt.show()
 
@@ -83,7 +78,7 @@ def main(args):
     ax.hlines(y=args.budget, xmin=risk.min(), xmax=risk.max(), color='r', linestyle='-', label='Budget')
     ax.set_xlabel('Risk')
     ax.set_ylabel('Return')
-    ax.set_title("Mean-Variance Efficient frtontier num assets = {} and budget = {}".format(args.num_assets, args.budget))
+    ax.set_title("Mean-Variance Efficient frtontier num assets = {} and budget = {}".format(market.N, args.budget))
     ax.set_xscale('log')
     plt.show()
 
@@ -96,10 +91,15 @@ if __name__ == "__main__":
     parser.add_argument("--time_period", type=int, default=256)
     parser.add_argument("--data_method", type=str, default="brownian_motion", choices=__available_methods)
     parser.add_argument("--data_path", type=str, default="datasets/data.csv")
+    parser.add_argument("--assets", type=str, nargs="*", default=None)
+    parser.add_argument("--float32", action="store_true")
 
     # Portfolio Optimization parameters
     parser.add_argument("--budget", type=float, default=1000)
     parser.add_argument("--gamma", type=float, default=2)
 
+    # Parallelism
+    parser.add_argument("--num_workers", type=int, default=1)
+
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Content-addressed caches: on-disk Ising Hamiltonians and reference solutions, in-memory circuits."""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+from numpy import ndarray
+
+from solver.vqe.qubo import z_terms
+
+# Age after which a temporary file is considered left over by an interrupted write
+STALE_TMP_SECONDS = 3600
+
+class ArtifactCache():
+    """
+    Directory of compressed npz archives named by the hash of the problem they were computed
+    for. Entries are evicted in least recently used order once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = 1 << 30) -> None:
+        """
+        Args:
+            cache_dir : Directory of the cache, created if needed
+            max_bytes : Maximum size of the cache on disk (None = no limit)
+        """
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._clean_tmp()
+
+    @staticmethod
+    def key(Cov: Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+            mu: ndarray,
+            gamma: float,
+            budget: float,
+            asset_limit: float,
+            encoding: Optional[ndarray] = None,
+            kind: str = "ising",
+            ) -> str:
+        """
+        Hash of a portfolio problem.
+        Args:
+            Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
+            mu : Assets' forecasts returns
+            gamma : Risk aversion coefficient
+            budget : Maximum budget
+            asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+            encoding : Coefficients of the binary expansion of one asset (None for classical artifacts)
+            kind : Kind of artifact stored under the key
+        Returns:
+            key : Hexadecimal digest
+        """
+
+        h = hashlib.sha1()
+        h.update(json.dumps([kind, float(gamma), float(budget), float(asset_limit)]).encode())
+        arrays = list(Cov) if isinstance(Cov, tuple) else [Cov]
+        arrays += [mu] if encoding is None else [mu, encoding]
+        for a in arrays:
+            a = np.ascontiguousarray(a, dtype=np.float64)
+            h.update(str(a.shape).encode())
+            h.update(a.tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, ndarray]]:
+        """
+        Load an entry and mark it as recently used. A corrupt entry counts as a miss and is removed.
+        Args:
+            key : Key of the entry
+        Returns:
+            arrays : Stored arrays, or None if the entry is not cached
+        """
+
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            self._misses += 1
+            self._remove(path)
+            return None
+
+        os.utime(path)
+        self._hits += 1
+        return arrays
+
+    def put(self, key: str, **arrays: ndarray) -> None:
+        """
+        Store an entry, then evict the least recently used entries above max_bytes.
+        Args:
+            key : Key of the entry
+            arrays : Arrays to store
+        """
+
+        # Write then rename so that concurrent readers never see a partial archive
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+        self._evict()
+
+    def cache_info(self) -> Dict:
+        """Statistics of the cache.
+        Returns:
+            info: Number of hits, misses, hit rate, number of entries and their size in bytes.
+        """
+
+        entries = self._entries()
+        queries = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / queries if queries else 0.0,
+            "size": len(entries),
+            "nbytes": sum(size for _, _, size in entries),
+            }
+
+    def clear(self) -> None:
+        """Remove every entry and reset the statistics."""
+
+        for path, _, _ in self._entries():
+            self._remove(path)
+        self._clean_tmp(max_age=0)
+        self._hits = 0
+        self._misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _clean_tmp(self, max_age: float = STALE_TMP_SECONDS) -> None:
+        # Writes in progress in other processes are younger than max_age
+        now = time.time()
+        for path in glob.glob(os.path.join(self.cache_dir, "*.tmp")):
+            try:
+                if now - os.stat(path).st_mtime >= max_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        nbytes = sum(size for _, _, size in entries)
+        for path, _, size in entries[:-1]:
+            if nbytes <= self.max_bytes:
+                break
+            self._remove(path)
+            nbytes -= size
+
+class CircuitCache():
+    """
+    In-memory cache of the transpiled ansatz, the expectation operator and the circuit sampler of
+    a configuration (ansatz, backend, Hamiltonian), so that the ansatz is transpiled once for all
+    the starting points of a run and for the later runs with the same configuration. Entries hold
+    no optimizer, gradient or callback. Entries are evicted in least recently used order above max_size.
+    """
+
+    def __init__(self, max_size: Optional[int] = 16) -> None:
+        """
+        Args:
+            max_size : Maximum number of configurations (None = no limit)
+        """
+
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(ansatz: Any, quantum_instance: Any, H: Any, spectrum: bool = False) -> str:
+        """
+        Hash of a VQE configuration, computed once per run.
+        Args:
+            ansatz : Parametrized circuit, the same configuration needs the same parameter objects (or a copy)
+            quantum_instance : Quantum instance running the circuits
+            H : Hamiltonian made of I and Z terms
+            spectrum : Whether the expectations are looked up in the precomputed spectrum
+        Returns:
+            key : Hexadecimal digest
+        """
+
+        h = hashlib.sha1()
+        circuit = ansatz.decompose()
+        h.update(str(circuit.num_qubits).encode())
+        for instruction in circuit.data:
+            qubits = [circuit.find_bit(q).index for q in instruction.qubits]
+            params = [str(p) for p in instruction.operation.params]
+            h.update(json.dumps([instruction.operation.name, qubits, params]).encode())
+
+        # The cached circuits are bound by parameter objects, which are only equal to themselves
+        h.update(json.dumps([hash(p) for p in ansatz.parameters]).encode())
+
+        # Everything the transpiler and the sampler depend on
+        config = [quantum_instance.backend_name, quantum_instance.is_statevector, quantum_instance.compile_config,
+                quantum_instance.backend_config, quantum_instance.run_config.to_dict(), spectrum]
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+
+        z, coeffs = z_terms(H)
+        for a in [z, coeffs]:
+            h.update(str(a.shape).encode())
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an entry and mark it as recently used.
+        Args:
+            key : Key of the entry
+        Returns:
+            entry : Stored objects, or None if the configuration is not cached
+        """
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Store an entry, then evict the least recently used entries above max_size.
+        Args:
+            key : Key of the entry
+            entry : Objects to store, the dictionary may be filled later on
+        """
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while self.max_size is not None and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def cache_info(self) -> Dict:
+        """Statistics of the cache.
+        Returns:
+            info: Number of hits, misses, hit rate and number of entries.
+        """
+
+        queries = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / queries if queries else 0.0,
+            "size": len(self._entries),
+            }
+
+    def clear(self) -> None:
+        """Remove every entry and reset the statistics."""
+
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
@@ -12,39 +12,155 @@
 
 """ CVXPY Optimization Method."""
 
-from typing import Optional
+from typing import Dict, Optional, Tuple, Union
 import cvxpy as cp
 import numpy as np
 from numpy import ndarray
 
-def CVXPYSolver(Cov:ndarray,
+def CVXPYSolver(Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
                 mu:ndarray,
                 gamma:float = 0.1,
                 budget: float = 1000,
                 asset_limit: float = 1.0,
-                verbose: Optional[bool] = False
+                verbose: Optional[bool] = False,
+                solver: str = cp.MOSEK,
                 ) -> float:
     """
     Take a Covariance matrix (from the different assets) and minimize the risk via Quadratic Programming.
 
     Args:
-        Cov : Covariance matrix
+        Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
         mu : Assets' forecasts returns
         gamma : Risk aversion coefficient
         budget : Maximum budget
         asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+        verbose : Solver verbosity
+        solver : CVXPY solver
     Returns:
         w : Optimum solution. w[i] is the asset allocation for asset i.
     """
 
     # Define and solve the CVXPY problem.
-    w = cp.Variable(Cov.shape[0], nonneg=True)
+    if isinstance(Cov, tuple):
+        B, F, D = Cov
+        w = cp.Variable(B.shape[0], nonneg=True)
+    else:
+        w = cp.Variable(Cov.shape[0], nonneg=True)
     
     constraints = [cp.sum(w) <= budget]
-    constraints += [np.eye(Cov.shape[0]) @ w <= asset_limit * budget * np.ones(Cov.shape[0])]
+    constraints += [w <= asset_limit * budget]
+
+    # A factor model keeps the formulation in O(NK) through the factor exposures y = B^T w
+    if isinstance(Cov, tuple):
+        y = cp.Variable(B.shape[1])
+        constraints += [y == B.T @ w]
+        risk = cp.quad_form(y, F) + cp.sum_squares(cp.multiply(np.sqrt(D), w))
+    else:
+        risk = cp.quad_form(w, Cov)
 
-    prob = cp.Problem(cp.Minimize(gamma * 0.5 * cp.quad_form(w,Cov) - mu.T @ w),
+    prob = cp.Problem(cp.Minimize(gamma * 0.5 * risk - mu.T @ w),
                     constraints)
 
-    prob.solve(solver=cp.MOSEK, verbose=verbose)
-    return prob.value, w.value
\ No newline at end of file
+    prob.solve(solver=solver, verbose=verbose)
+    return prob.value, w.value
+
+class CVXPYFrontier():
+    """
+    Efficient frontier solver. The CVXPY problem is built once with the risk aversion, the forecast
+    returns and the budget as parameters, so that sweeping them only costs one canonicalization.
+    """
+    def __init__(self,
+                Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+                mu:ndarray,
+                budget: float = 1000,
+                asset_limit: float = 1.0,
+                solver: str = cp.MOSEK,
+                verbose: Optional[bool] = False
+                ) -> None:
+        """
+        Args:
+            Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
+            mu : Assets' forecasts returns
+            budget : Maximum budget
+            asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+            solver : CVXPY solver
+            verbose : Solver verbosity
+        """
+
+        self._solver = solver
+        self._verbose = verbose
+
+        if isinstance(Cov, tuple):
+            B, F, D = Cov
+            N = B.shape[0]
+        else:
+            N = Cov.shape[0]
+
+        self._gamma = cp.Parameter(nonneg=True, value=0.1)
+        self._mu = cp.Parameter(N, value=mu)
+        self._budget = cp.Parameter(nonneg=True, value=budget)
+        self._w = cp.Variable(N, nonneg=True)
+
+        constraints = [cp.sum(self._w) <= self._budget]
+        constraints += [self._w <= asset_limit * self._budget]
+
+        if isinstance(Cov, tuple):
+            y = cp.Variable(B.shape[1])
+            constraints += [y == B.T @ self._w]
+            self._risk = cp.quad_form(y, F) + cp.sum_squares(cp.multiply(np.sqrt(D), self._w))
+        else:
+            self._risk = cp.quad_form(self._w, Cov)
+
+        self._prob = cp.Problem(cp.Minimize(self._gamma * 0.5 * self._risk - self._mu.T @ self._w),
+                        constraints)
+
+    def solve(self,
+            gammas: ndarray,
+            mu: Optional[ndarray] = None,
+            budget: Optional[float] = None,
+            ) -> Dict[str, ndarray]:
+        """
+        Solve the problem for each risk aversion coefficient, warm starting from the previous solution.
+
+        Args:
+            gammas : Risk aversion coefficients
+            mu : Assets' forecasts returns (unchanged if None)
+            budget : Maximum budget (unchanged if None)
+        Returns:
+            frontier : Arrays of objective values, risks w^T Cov w, returns and weights (one row per gamma).
+                Failed solves are set to NaN.
+        """
+
+        if mu is not None:
+            self._mu.value = mu
+        if budget is not None:
+            self._budget.value = budget
+
+        gammas = np.asarray(gammas, dtype=float)
+        values = np.full(len(gammas), np.nan)
+        risk = np.full(len(gammas), np.nan)
+        ret = np.full(len(gammas), np.nan)
+        weights = np.full((len(gammas), self._w.shape[0]), np.nan)
+
+        for i, gamma in enumerate(gammas):
+            self._gamma.value = gamma
+            try:
+                self._prob.solve(solver=self._solver, warm_start=True, verbose=self._verbose)
+            except cp.error.SolverError:
+                continue
+            if self._w.value is None:
+                continue
+
+            w = self._w.value
+            values[i] = self._prob.value
+            risk[i] = self._risk.value
+            ret[i] = (1 + self._mu.value) @ w + self._budget.value - np.sum(w)
+            weights[i] = w
+
+        return {
+            "gammas": gammas,
+            "values": values,
+            "risk": risk,
+            "returns": ret,
+            "weights": weights,
+            }
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Process-parallel CVXPY frontiers and reference solves."""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple, Union
+
+import cvxpy as cp
+import numpy as np
+from numpy import ndarray
+
+from solver.cvxpy.cvxpy_solver import CVXPYSolver, CVXPYFrontier
+
+# Problem instance held by each worker process
+_frontier = None
+
+def parallel_frontier(Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+                    mu:ndarray,
+                    gammas: ndarray,
+                    budget: float = 1000,
+                    asset_limit: float = 1.0,
+                    solver: str = cp.MOSEK,
+                    num_workers: int = 1,
+                    chunks_per_worker: int = 4,
+                    ) -> Dict[str, ndarray]:
+    """
+    Compute the efficient frontier over a process pool. Each worker builds its own CVXPYFrontier
+    once and solves contiguous chunks of gammas with warm starts.
+
+    Args:
+        Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
+        mu : Assets' forecasts returns
+        gammas : Risk aversion coefficients
+        budget : Maximum budget
+        asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+        solver : CVXPY solver
+        num_workers : Number of worker processes
+        chunks_per_worker : Number of gamma chunks per worker, for load balancing
+    Returns:
+        frontier : Arrays of objective values, risks, returns and weights, as returned by CVXPYFrontier.solve.
+    """
+
+    gammas = np.asarray(gammas, dtype=float)
+    if gammas.size == 0:
+        N = mu.shape[0]
+        empty = np.empty(0)
+        return {"gammas": empty, "values": empty, "risk": empty, "returns": empty, "weights": np.empty((0, N))}
+
+    chunks = [c for c in np.array_split(gammas, num_workers * chunks_per_worker) if len(c) > 0]
+
+    with ProcessPoolExecutor(max_workers=num_workers,
+                            initializer=_init_frontier,
+                            initargs=(Cov, mu, budget, asset_limit, solver)) as executor:
+        results = list(executor.map(_solve_frontier, chunks))
+
+    return {key: np.concatenate([res[key] for res in results]) for key in results[0]}
+
+def parallel_solve(problems: List[Dict],
+                num_workers: int = 1,
+                solver: str = cp.MOSEK,
+                ) -> Tuple[ndarray, ndarray]:
+    """
+    Solve many independent portfolio problems (e.g. reference solves of many markets) over a process pool.
+
+    Args:
+        problems : Keyword arguments of CVXPYSolver for each problem (Cov, mu, gamma, budget, asset_limit).
+            All problems should have the same number of assets.
+        num_workers : Number of worker processes
+        solver : CVXPY solver
+    Returns:
+        values : Optimal values, NaN for failed solves.
+        weights : Optimum solutions, one row per problem (empty arrays for no problem).
+    """
+
+    if len(problems) == 0:
+        return np.empty(0), np.empty((0, 0))
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        chunksize = max(1, len(problems) // (4 * num_workers))
+        results = list(executor.map(partial(_solve_problem, solver=solver), problems, chunksize=chunksize))
+
+    values = np.array([value for value, _ in results], dtype=float)
+    weights = np.stack([w for _, w in results])
+    return values, weights
+
+def _init_frontier(Cov, mu, budget, asset_limit, solver) -> None:
+
+    global _frontier
+    _frontier = CVXPYFrontier(Cov=Cov, mu=mu, budget=budget, asset_limit=asset_limit, solver=solver)
+
+def _solve_frontier(gammas: ndarray) -> Dict[str, ndarray]:
+
+    return _frontier.solve(gammas)
+
+def _solve_problem(problem: Dict, solver: str) -> Tuple[float, ndarray]:
+
+    N = problem["mu"].shape[0]
+    try:
+        value, w = CVXPYSolver(**problem, solver=solver)
+    except cp.error.SolverError:
+        value, w = None, None
+
+    if w is None:
+        return np.nan, np.full(N, np.nan)
+    return value, w
@@ -12,18 +12,25 @@
 
 """ Iterated local search enhanced VQE for Portfolio Optimization."""
 
-from typing import Optional, List
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import copy
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Optional, List, Tuple
 
 import numpy as np
 from numpy import ndarray
 from scipy.stats import qmc
 from tqdm import tqdm
 
-from qiskit.utils import QuantumInstance
+from qiskit.utils import QuantumInstance, algorithm_globals
 from qiskit.circuit import QuantumCircuit
 from qiskit.algorithms.optimizers import Optimizer
 
 from solver.vqe.vqe_solver import VQESolver
+from solver.vqe.qubo import z_terms
+from solver.cache import ArtifactCache, CircuitCache
 from solver.utils import new_inter
 
 class ILSSolver():
@@ -37,6 +44,9 @@ class ILSSolver():
                 budget: float = 1000,
                 asset_limit: float = 1.0,
                 sampler_method: Optional[str] = "sobol",
+                cache: Optional[ArtifactCache] = None,
+                spectrum: bool = False,
+                circuit_cache: Optional[CircuitCache] = None,
                 ) -> None:
                 """
                 Args:
@@ -46,6 +56,11 @@ class ILSSolver():
                         budget : Maximum budget
                         asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
                         sampler_method : Sampling method for initializing the ansatz at each round.
+                        cache : Artifact cache of the Ising model
+                        spectrum : Precompute the energy spectrum of the Ising model and look up the expectations of the "qiskit"
+                                backend in it, otherwise the Pauli terms are measured (the "numpy" backend always uses the spectrum)
+                        circuit_cache : Cache of the transpiled circuits of the "qiskit" backend, shared by the starting
+                                points and by the later runs (None = the ansatz is transpiled for each starting point)
                 """
 
                 # Get parameters
@@ -63,9 +78,13 @@ class ILSSolver():
                         budget= self._budget, 
                         asset_limit= self._asset_limit
                         )
-                self._vqe.to_ising()
+                self._vqe.to_ising(cache=cache)
+                if spectrum:
+                        self._vqe.spectrum()
 
                 self._sampler_method = sampler_method
+                self._circuit_cache = circuit_cache
+                self._expectation = "spectrum" if spectrum else "pauli"
 
         def compute_seq(self, N: int,
                         num_parameters: int) -> None:
@@ -83,44 +102,199 @@ class ILSSolver():
         def solve(self,
                 ansatz: QuantumCircuit,
                 opt: Optimizer,
-                qi: QuantumInstance
+                qi: QuantumInstance,
+                backend: str = "qiskit",
+                gradient: Optional[str] = None,
+                num_workers: int = 1,
+                seed: Optional[int] = None,
                 ) -> List:
                 """
                 Args:
                         ansatz: QuantumCircuit,
                         opt: Optimizer,
                         qi: QuantumInstance 
+                        backend: "qiskit" or "numpy" (batched NumPy simulator of the TwoLocal ry/rz/cz ansatz)
+                        gradient: None, "adjoint" or "parameter_shift"
+                        num_workers: Number of worker processes running the starting points
+                        seed: Seed of the random generators of each starting point, so that the results do not depend
+                                on num_workers. The global NumPy and qiskit generators are left as they were
                 """
 
+                inits = [new_inter(samp) for samp in self.samples]
+                seeds = [None] * len(inits)
+                if seed is not None:
+                        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(inits))]
+
+                if num_workers > 1:
+                        return self._solve_parallel(ansatz, opt, qi, backend, gradient, num_workers, inits, seeds)
+
+                circuits = self._circuits(ansatz, qi, backend)
                 data = []  
-                for samp in tqdm(self.samples):
-
-                        init_weights = new_inter(samp)
-
-                        counts = []
-                        values = []
-                        param = []
-                        def store_intermediate_result(eval_count, parameters, mean, std):
-                                        counts.append(eval_count)
-                                        values.append(mean)
-                                        param.append(parameters)
-
-                        self._vqe.vqe_instance(ansatz=ansatz,
-                                        optimizer=opt, 
-                                        init= init_weights,
-                                        quantum_instance=qi, 
-                                        callback=store_intermediate_result)
-
-                        self._vqe.solve()
-                        data.append({
-                                "counts": np.asarray(counts),
-                                "values": np.asarray(values) + self._vqe.offset,
-                                "parameters": param
-                                })
+                for init_weights, start_seed in zip(tqdm(inits), seeds):
+                        data.append(_run_start(self._vqe, ansatz, opt, qi, backend, gradient, init_weights, start_seed,
+                                        circuits=circuits, expectation=self._expectation))
 
                         self._data = data
                 return data
 
+        def _solve_parallel(self, ansatz, opt, qi, backend, gradient, num_workers, inits, seeds) -> List:
+                """
+                Run the starting points over a process pool. The Z terms of the Hamiltonian and its spectrum
+                are placed in shared memory once, and each worker builds its own VQESolver on top of them.
+                The spectrum is only shared, without copy, when the run uses it. With the "qiskit" backend each
+                worker still builds its own Hamiltonian operator from the Z terms, and with a circuit cache each worker transpiles the
+                ansatz once for all its starting points. The "numpy" backend only needs the spectrum, which
+                is computed here first so that the workers neither build the operator nor their own spectrum.
+                """
+                use_spectrum = backend == "numpy" or self._expectation == "spectrum"
+                if use_spectrum and self._vqe.energies is None:
+                        self._vqe.spectrum()
+
+                z, coeffs = z_terms(self._vqe.H)
+                arrays = [z, coeffs] + ([self._vqe.energies] if use_spectrum else [])
+                shms, specs = _share(arrays)
+                try:
+                        with ProcessPoolExecutor(max_workers=num_workers,
+                                                initializer=_init_worker,
+                                                initargs=(specs, self._vqe.offset, ansatz, opt, qi, backend, gradient,
+                                                        self._circuit_cache is not None, self._expectation)) as executor:
+                                data = list(tqdm(executor.map(_run_worker, inits, seeds), total=len(inits)))
+                finally:
+                        for shm in shms:
+                                shm.close()
+                                shm.unlink()
+
+                self._data = data
+                return data
+
+        def race(self,
+                ansatz: QuantumCircuit,
+                opt: Optimizer,
+                qi: QuantumInstance,
+                backend: str = "qiskit",
+                gradient: Optional[str] = None,
+                keep: float = 0.5,
+                round_evals: int = 25,
+                max_evals: Optional[int] = None,
+                deadline: Optional[float] = None,
+                seed: Optional[int] = None,
+                ) -> List:
+                """
+                Successive halving over the starting points: all starts are advanced in rounds, and only
+                the best fraction of them is kept after each round. The evaluations of the discarded starts
+                are given to the survivors, whose optimizer is restarted from their best parameters.
+                Args:
+                        ansatz: QuantumCircuit,
+                        opt: Optimizer,
+                        qi: QuantumInstance 
+                        backend: "qiskit" or "numpy" (batched NumPy simulator of the TwoLocal ry/rz/cz ansatz)
+                        gradient: None, "adjoint" or "parameter_shift"
+                        keep: Fraction of the starts kept after each round
+                        round_evals: Evaluations of each start in the first round
+                        max_evals: Total number of energy evaluations (None = as many as solve, maxiter per start). Only the
+                                evaluations reported to the callback count, not the circuits of the gradients (2P per
+                                parameter-shift gradient). The runs are stopped once their share is spent, whatever the optimizer
+                        deadline: Wall-clock time limit in seconds. The running optimizer is stopped when it is reached,
+                                and the best result so far, including the partial run, is returned
+                        seed: Seed of the random generators of each start and round
+                Returns:
+                        data: Same format as solve, with the number of rounds run by each start under "rounds".
+                                The best value, parameters and start are stored in self.best
+                """
+
+                if not 0 < keep < 1:
+                        raise ValueError(f"keep should be in (0, 1), got {keep}")
+
+                inits = [new_inter(samp) for samp in self.samples]
+                N = len(inits)
+                if max_evals is None:
+                        max_evals = N * opt.settings.get("maxiter", round_evals)
+                streams = np.random.SeedSequence(seed).spawn(N) if seed is not None else None
+                end = time.monotonic() + deadline if deadline is not None else None
+
+                # Work on a copy so that the maxiter of the caller's optimizer is left untouched
+                opt = copy.deepcopy(opt)
+                circuits = self._circuits(ansatz, qi, backend)
+
+                data = [{"counts": [], "values": [], "parameters": [], "rounds": 0} for _ in range(N)]
+                points = list(inits)
+                best = [np.inf] * N
+                survivors = list(range(N))
+                used = 0
+                timed_out = False
+                # Every start runs in the first round, even for a budget below N * round_evals
+                budget = max(1, min(round_evals, max_evals // N))
+                while survivors and used < max_evals:
+                        converged = True
+                        for k in survivors:
+                                if end is not None and time.monotonic() > end:
+                                        timed_out = True
+                                        break
+
+                                evals = min(budget, max_evals - used)
+                                if evals <= 0:
+                                        break
+                                opt.set_options(maxiter=int(evals))
+                                start_seed = int(streams[k].spawn(1)[0].generate_state(1)[0]) if streams is not None else None
+                                res = _run_start(self._vqe, ansatz, opt, qi, backend, gradient, points[k], start_seed,
+                                                max_evals=int(evals), deadline=end, circuits=circuits, expectation=self._expectation)
+
+                                offset = data[k]["counts"][-1] if len(data[k]["counts"]) else 0
+                                data[k]["counts"].extend(offset + res["counts"])
+                                data[k]["values"].extend(res["values"])
+                                data[k]["parameters"].extend(res["parameters"])
+                                data[k]["rounds"] += 1
+                                used += len(res["counts"])
+                                converged &= len(res["counts"]) < evals
+
+                                if len(res["values"]):
+                                        i = int(np.argmin(res["values"]))
+                                        if res["values"][i] < best[k]:
+                                                best[k] = res["values"][i]
+                                                points[k] = np.asarray(res["parameters"][i])
+
+                                if end is not None and time.monotonic() > end:
+                                        timed_out = True
+                                        break
+
+                        if converged or timed_out:
+                                break
+
+                        # Keep the best fraction, each survivor gets the budget of the discarded starts
+                        num_keep = max(1, int(np.ceil(keep * len(survivors))))
+                        budget = int(np.ceil(budget * len(survivors) / num_keep))
+                        survivors = sorted(survivors, key=lambda k: best[k])[:num_keep]
+
+                for d in data:
+                        d["counts"] = np.asarray(d["counts"])
+                        d["values"] = np.asarray(d["values"])
+
+                # Best result found so far, also when the deadline was reached
+                k = int(np.argmin(best))
+                self.best = {"value": best[k], "parameters": points[k], "start": k}
+
+                self._data = data
+                return data
+
+        def _circuits(self, ansatz: QuantumCircuit, qi: QuantumInstance, backend: str) -> Optional[Dict]:
+                """
+                Entry of the circuit cache for this run, looked up once for all the starting points.
+                """
+                if self._circuit_cache is None or backend != "qiskit":
+                        return None
+
+                key = CircuitCache.key(ansatz, qi, self._vqe.H, self._expectation == "spectrum")
+                circuits = self._circuit_cache.get(key)
+                if circuits is None:
+                        circuits = {}
+                        self._circuit_cache.put(key, circuits)
+                return circuits
+
+        @property
+        def circuit_cache(self) -> Optional[CircuitCache]:
+                """ Returns the cache of transpiled circuits. """
+                return self._circuit_cache
+
         @property
         def vqe(self) -> VQESolver:
                 """ Returns the VQE solver. """
@@ -130,3 +304,144 @@ class ILSSolver():
         def vqe(self, value: VQESolver) -> None:
                 """ Sets the VQE solver. """
                 self._vqe = value
+
+# Solver and run configuration held by each worker process
+_worker = None
+
+class _StoppableOptimizer(Optimizer):
+    """
+    Optimizer running another one, whose objective is no longer evaluated once stop() is true: the last
+    energy is returned instead (and a zero gradient), so the optimizer winds down on a flat objective.
+    Raising instead would go through the C code of optimizers such as COBYLA, which print the traceback.
+    """
+
+    def __init__(self, optimizer: Optimizer, stop: Callable[[], bool]) -> None:
+        self._optimizer = optimizer
+        self._stop = stop
+        super().__init__()
+
+    def get_support_level(self) -> Dict:
+        return self._optimizer.get_support_level()
+
+    @property
+    def settings(self) -> Dict:
+        return self._optimizer.settings
+
+    def set_max_evals_grouped(self, limit: int) -> None:
+        super().set_max_evals_grouped(limit)
+        self._optimizer.set_max_evals_grouped(limit)
+
+    def minimize(self, fun, x0, jac=None, bounds=None):
+        last = None
+
+        def objective(x):
+            nonlocal last
+            # The first point is always evaluated, so that there is a value to return
+            if last is None or not self._stop():
+                last = fun(x)
+            return last
+
+        def gradient(x):
+            if last is not None and self._stop():
+                return np.zeros_like(x)
+            return jac(x)
+
+        return self._optimizer.minimize(fun=objective, x0=x0, jac=gradient if jac is not None else None, bounds=bounds)
+
+def _run_start(vqe: VQESolver,
+            ansatz: QuantumCircuit,
+            opt: Optimizer,
+            qi: QuantumInstance,
+            backend: str,
+            gradient: Optional[str],
+            init_weights: ndarray,
+            seed: Optional[int] = None,
+            max_evals: Optional[int] = None,
+            deadline: Optional[float] = None,
+            circuits: Optional[Dict] = None,
+            expectation: str = "pauli",
+            ) -> Dict:
+    """Run the VQE from one starting point and record its convergence. The energy is no longer evaluated,
+    keeping the history so far, once max_evals evaluations are recorded or past the time.monotonic() deadline.
+    The start draws its random numbers from its own generator seeded with seed."""
+
+    rng = np.random.default_rng(seed) if seed is not None else None
+
+    counts = []
+    values = []
+    param = []
+    def store_intermediate_result(eval_count, parameters, mean, std):
+        counts.append(eval_count)
+        values.append(mean)
+        param.append(parameters)
+
+    def stopped():
+        return (max_evals is not None and len(counts) >= max_evals) or (deadline is not None and time.monotonic() > deadline)
+
+    if max_evals is not None or deadline is not None:
+        opt = _StoppableOptimizer(opt, stopped)
+
+    vqe.vqe_instance(ansatz=ansatz,
+                optimizer=opt,
+                init=init_weights,
+                quantum_instance=qi,
+                callback=store_intermediate_result,
+                backend=backend,
+                gradient=gradient,
+                circuits=circuits,
+                expectation=expectation,
+                rng=rng)
+
+    with _algorithm_seed(seed):
+        vqe.solve()
+    return {
+        "counts": np.asarray(counts),
+        "values": np.asarray(values) + vqe.offset,
+        "parameters": param
+        }
+
+@contextmanager
+def _algorithm_seed(seed: Optional[int]):
+    """Seed the qiskit generator (initial point, stochastic optimizers) for the duration of the block,
+    then restore the caller's generator and its state."""
+
+    if seed is None:
+        yield
+        return
+
+    previous_seed, previous_random = algorithm_globals.random_seed, algorithm_globals._random
+    algorithm_globals.random_seed = seed
+    try:
+        yield
+    finally:
+        algorithm_globals.random_seed = previous_seed
+        algorithm_globals._random = previous_random
+
+def _share(arrays: List[ndarray]) -> Tuple[List[SharedMemory], List[Tuple[str, Tuple, str]]]:
+    """Copy arrays to shared memory blocks, returned with the (name, shape, dtype) to attach them."""
+
+    shms, specs = [], []
+    for a in arrays:
+        shm = SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+        shms.append(shm)
+        specs.append((shm.name, a.shape, a.dtype.str))
+    return shms, specs
+
+def _init_worker(specs, offset, ansatz, opt, qi, backend, gradient, cache_circuits, expectation) -> None:
+    global _worker
+
+    # The views stay valid as long as the blocks are referenced
+    shms = [SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (_, shape, dtype) in zip(shms, specs)]
+    spectrum = arrays[2] if len(arrays) > 2 else None
+
+    vqe = VQESolver()
+    vqe.load_ising(arrays[0], arrays[1], offset, spectrum=spectrum)
+    circuits = {} if cache_circuits and backend == "qiskit" else None
+    _worker = (shms, vqe, ansatz, opt, qi, backend, gradient, circuits, expectation)
+
+def _run_worker(init_weights: ndarray, seed: Optional[int]) -> Dict:
+    _, vqe, ansatz, opt, qi, backend, gradient, circuits, expectation = _worker
+    return _run_start(vqe, ansatz, opt, qi, backend, gradient, init_weights, seed, circuits=circuits,
+                expectation=expectation)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" NumPy Quadratic Programming Method for the long-only budget/box portfolio problem."""
+
+from typing import Callable, Optional, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+def QPSolver(Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+            mu:ndarray,
+            gamma:float = 0.1,
+            budget: float = 1000,
+            asset_limit: float = 1.0,
+            verbose: Optional[bool] = False,
+            tol: float = 1e-9,
+            maxiter: int = 100000,
+            polish_every: int = 50,
+            ) -> float:
+    """
+    Drop-in replacement of CVXPYSolver that does not need any solver license. Minimize
+    gamma/2 w^T Cov w - mu^T w subject to sum(w) <= budget and 0 <= w <= asset_limit * budget
+    with an accelerated projected gradient method (FISTA with adaptive restart) and an exact
+    projection on the feasible set. The gradient iterations are only used to identify the
+    active constraints: the solution is then polished by solving the KKT system on them.
+
+    Args:
+        Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
+        mu : Assets' forecasts returns
+        gamma : Risk aversion coefficient
+        budget : Maximum budget
+        asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+        verbose : Print the convergence status
+        tol : Tolerance on the relative step length
+        maxiter : Maximum number of iterations
+        polish_every : Number of iterations between two polishing attempts
+    Returns:
+        w : Optimum solution. w[i] is the asset allocation for asset i.
+    """
+
+    matvec = _matvec(Cov)
+    upper = asset_limit * budget
+
+    # Lipschitz constant of the gradient
+    L = gamma * _max_eigenvalue(matvec, mu.shape[0])
+    L = max(L, np.finfo(float).eps * max(1.0, np.max(np.abs(mu))))
+
+    x = project(np.zeros(mu.shape[0]), upper, budget)
+    y = x
+    t = 1.0
+    polished = False
+    for it in range(maxiter):
+        grad = gamma * matvec(y) - mu
+        x_new = project(y - grad / L, upper, budget)
+
+        step = np.linalg.norm(x_new - x)
+        if step <= tol * max(1.0, np.linalg.norm(x_new)):
+            x = x_new
+            break
+
+        if (it + 1) % polish_every == 0:
+            w = _polish(Cov, matvec, mu, gamma, upper, budget, x_new)
+            if w is not None:
+                x, polished = w, True
+                break
+
+        # Restart the momentum when it goes against the gradient step
+        if np.dot(y - x_new, x_new - x) > 0:
+            t = 1.0
+        t_new = (1 + np.sqrt(1 + 4 * t**2)) / 2
+        y = x_new + (t - 1) / t_new * (x_new - x)
+        x, t = x_new, t_new
+
+    if not polished:
+        w = _polish(Cov, matvec, mu, gamma, upper, budget, x)
+        if w is not None:
+            x, polished = w, True
+
+    if verbose:
+        print("QPSolver: {} iterations, last relative step {:.2e}, polished: {}".format(it + 1, step / max(1.0, np.linalg.norm(x)), polished))
+
+    value = gamma * 0.5 * x @ matvec(x) - mu @ x
+    return value, x
+
+def BatchQPSolver(Cov: ndarray,
+                mu: ndarray,
+                gamma: Union[float, ndarray] = 0.1,
+                budget: Union[float, ndarray] = 1000,
+                asset_limit: Union[float, ndarray] = 1.0,
+                verbose: Optional[bool] = False,
+                eps_abs: float = 1e-8,
+                eps_rel: float = 1e-8,
+                maxiter: int = 20000,
+                alpha: float = 1.6,
+                polish: bool = True,
+                ) -> Tuple[ndarray, ndarray]:
+    """
+    Solve a batch of same-sized portfolio problems at once with a vectorized ADMM. Each problem
+    stops iterating as soon as its own residuals converge, and its solution is then polished
+    on its active constraints as in QPSolver.
+
+    Args:
+        Cov : Covariance matrices of shape (B, N, N)
+        mu : Assets' forecasts returns of shape (B, N)
+        gamma : Risk aversion coefficients, scalar or of shape (B,)
+        budget : Maximum budgets, scalar or of shape (B,)
+        asset_limit : Maximum fractions of budget allocation per asset, scalar or of shape (B,)
+        verbose : Print the convergence status
+        eps_abs : Absolute tolerance on the primal and dual residuals
+        eps_rel : Relative tolerance on the primal and dual residuals
+        maxiter : Maximum number of iterations
+        alpha : Over-relaxation parameter in (0, 2)
+        polish : Polish the solutions on their active constraints
+    Returns:
+        values : Optimal values of shape (B,)
+        w : Optimum solutions of shape (B, N)
+    """
+
+    num_problems, N = mu.shape
+    gamma = np.broadcast_to(np.asarray(gamma, dtype=float), (num_problems,))
+    budget = np.broadcast_to(np.asarray(budget, dtype=float), (num_problems,))
+    upper = np.broadcast_to(np.asarray(asset_limit, dtype=float), (num_problems,)) * budget
+
+    # Step size of each problem balanced on the spectrum of its quadratic term
+    P = gamma[:, None, None] * Cov
+    eigs = np.linalg.eigvalsh(P)
+    rho = np.sqrt(np.maximum(eigs[:, 0], 1e-6 * eigs[:, -1]) * eigs[:, -1])
+    rho = np.where(rho > 0, rho, 1.0)
+    M = np.linalg.inv(P + rho[:, None, None] * np.eye(N))
+
+    w = np.zeros((num_problems, N))
+    z = np.zeros((num_problems, N))
+    u = np.zeros((num_problems, N))
+    active = np.ones(num_problems, dtype=bool)
+    iterations = np.zeros(num_problems, dtype=int)
+
+    for it in range(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        z_prev = z[idx]
+        w_a = np.einsum("bij,bj->bi", M[idx], mu[idx] + rho[idx, None] * (z_prev - u[idx]))
+
+        # Over-relaxed z and scaled dual updates
+        w_r = alpha * w_a + (1 - alpha) * z_prev
+        z_a = project(w_r + u[idx], upper[idx, None], budget[idx])
+        u[idx] += w_r - z_a
+        w[idx], z[idx] = w_a, z_a
+        iterations[idx] += 1
+
+        # Primal and dual residuals of each problem
+        r = np.linalg.norm(w_a - z_a, axis=1)
+        s = rho[idx] * np.linalg.norm(z_a - z_prev, axis=1)
+        eps_pri = eps_abs * np.sqrt(N) + eps_rel * np.maximum(np.linalg.norm(w_a, axis=1), np.linalg.norm(z_a, axis=1))
+        eps_dual = eps_abs * np.sqrt(N) + eps_rel * rho[idx] * np.linalg.norm(u[idx], axis=1)
+        active[idx[(r <= eps_pri) & (s <= eps_dual)]] = False
+
+    polished = np.zeros(num_problems, dtype=bool)
+    if polish:
+        for b in range(num_problems):
+            matvec = _matvec(Cov[b])
+            x = _polish(Cov[b], matvec, mu[b], gamma[b], upper[b], budget[b], z[b])
+            if x is not None:
+                z[b], polished[b] = x, True
+
+    if verbose:
+        print("BatchQPSolver: {} iterations at most, {} not converged, {} polished".format(iterations.max(), active.sum(), polished.sum()))
+
+    values = gamma * 0.5 * np.einsum("bi,bij,bj->b", z, Cov, z) - np.einsum("bi,bi->b", mu, z)
+    return values, z
+
+def project(v: ndarray,
+            upper: Union[float, ndarray],
+            budget: Union[float, ndarray],
+            ) -> ndarray:
+    """
+    Exact Euclidean projection on {w : 0 <= w <= upper, sum(w) <= budget}, along the last axis of v.
+
+    Args:
+        v : Points to project, of shape (..., N)
+        upper : Upper bounds, broadcastable to v
+        budget : Budgets, broadcastable to v.shape[:-1]
+    Returns:
+        w : Projected points
+    """
+
+    upper = np.broadcast_to(upper, v.shape)
+    budget = np.broadcast_to(budget, v.shape[:-1])
+
+    w = np.clip(v, 0, upper)
+    over = np.sum(w, axis=-1) > budget
+    if not np.any(over):
+        return w
+
+    # The budget is active: find tau > 0 such that g(tau) = sum(clip(v - tau, 0, upper)) = budget.
+    # g is piecewise linear and nonincreasing, with breakpoints at v (w leaves 0) and v - upper
+    # (w reaches upper). Sweeping the sorted breakpoints downwards gives g on each of them exactly.
+    vo, uo, bo = v[over], upper[over], budget[over]
+    events = np.concatenate([vo, vo - uo], axis=-1)
+    order = np.argsort(-events, axis=-1)
+    events = np.take_along_axis(events, order, axis=-1)
+    slopes = np.cumsum(np.take_along_axis(np.concatenate([np.ones_like(vo), -np.ones_like(vo)], axis=-1), order, axis=-1), axis=-1)
+
+    g = np.zeros_like(events)
+    g[:, 1:] = np.cumsum(slopes[:, :-1] * (events[:, :-1] - events[:, 1:]), axis=-1)
+
+    # Interpolate on the segment where g crosses the budget
+    k = np.argmax(g >= bo[:, None], axis=-1)
+    rows = np.arange(len(k))
+
+    # A zero budget is reached at the first breakpoint, where every weight is zero
+    prev = np.maximum(k - 1, 0)
+    slope = np.where(k > 0, slopes[rows, prev], 1.0)
+    tau = np.where(k > 0, events[rows, prev] - (bo - g[rows, prev]) / slope, events[rows, 0])
+
+    w[over] = np.clip(vo - tau[:, None], 0, uo)
+    return w
+
+def _polish(Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+            matvec: Callable[[ndarray], ndarray],
+            mu: ndarray,
+            gamma: float,
+            upper: float,
+            budget: float,
+            x: ndarray,
+            max_updates: int = 50,
+            ) -> Optional[ndarray]:
+    """
+    Solve the KKT system on the active constraints guessed from x, correcting the guess with
+    primal-dual active set updates. Returns None if no optimal point is found.
+    """
+
+    at_lower = x <= 0
+    at_upper = x >= upper
+    budget_active = np.sum(x) >= budget * (1 - 1e-12)
+
+    for _ in range(max_updates):
+        free = ~(at_lower | at_upper)
+        F = np.flatnonzero(free)
+
+        w = np.where(at_upper, upper, 0.0)
+        rhs = mu[F] - gamma * matvec(w)[F]
+
+        if isinstance(Cov, tuple):
+            B, Fc, D = Cov
+            A = gamma * (B[F] @ Fc @ B[F].T + np.diag(D[F]))
+        else:
+            A = gamma * Cov[np.ix_(F, F)]
+
+        # The budget multiplier lam borders the system when the budget is active
+        try:
+            if budget_active:
+                K = np.block([[A, np.ones((len(F), 1))], [np.ones((1, len(F))), np.zeros((1, 1))]])
+                sol = np.linalg.solve(K, np.append(rhs, budget - np.sum(w)))
+                w[F], lam = sol[:-1], sol[-1]
+            else:
+                w[F], lam = np.linalg.solve(A, rhs), 0.0
+        except np.linalg.LinAlgError:
+            return None
+
+        grad = gamma * matvec(w) - mu + lam
+        eps_w = 1e-9 * upper
+        eps_g = 1e-9 * max(np.max(np.abs(mu)), np.max(np.abs(grad - lam + mu)), abs(lam), np.finfo(float).tiny)
+
+        below = free & (w < -eps_w)
+        above = free & (w > upper + eps_w)
+        release = (at_lower & (grad < -eps_g)) | (at_upper & (grad > eps_g))
+        drop_budget = budget_active and lam < -eps_g
+        add_budget = not budget_active and np.sum(w) > budget * (1 + 1e-12)
+
+        if not (below.any() or above.any() or release.any() or drop_budget or add_budget):
+            return np.clip(w, 0, upper)
+
+        at_lower = (at_lower & ~release) | below
+        at_upper = (at_upper & ~release) | above
+        budget_active = (budget_active and not drop_budget) or add_budget
+
+    return None
+
+def _matvec(Cov:Union[ndarray, Tuple[ndarray, ndarray, ndarray]]) -> Callable[[ndarray], ndarray]:
+
+    if isinstance(Cov, tuple):
+        B, F, D = Cov
+        return lambda w: B @ (F @ (B.T @ w)) + D * w
+    return lambda w: Cov @ w
+
+def _max_eigenvalue(matvec: Callable[[ndarray], ndarray], N: int, iterations: int = 100) -> float:
+    """Largest eigenvalue of a positive semi-definite operator by power iteration, with a safety margin."""
+
+    x = np.random.default_rng(0).standard_normal(N)
+    lam = 0.0
+    for _ in range(iterations):
+        y = matvec(x)
+        norm = np.linalg.norm(y)
+        if norm == 0:
+            return 0.0
+        lam_new = np.dot(x, y) / np.dot(x, x)
+        x = y / norm
+        if abs(lam_new - lam) <= 1e-6 * lam_new:
+            lam = lam_new
+            break
+        lam = lam_new
+
+    return 1.05 * lam
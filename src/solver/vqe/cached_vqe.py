@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" VQE reusing the transpiled circuits of an earlier VQE with the same configuration."""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from qiskit.algorithms import VQE
+from qiskit.opflow import ExpectationBase, OperatorBase
+
+class CachedVQE(VQE):
+    """
+    VQE sharing its expectation operator and circuit sampler through a dictionary, such as an entry
+    of a CircuitCache. The circuit sampler keeps the transpiled circuits of the last operator it
+    converted, so VQEs built on the same entry only transpile the ansatz once. The entry only holds
+    circuits, operators and the sampler: the optimizer, gradient and callback stay with each VQE.
+    """
+
+    def __init__(self, *args, circuits: Optional[Dict] = None, **kwargs) -> None:
+        """
+        Args:
+            args : Arguments of the VQE
+            circuits : Shared dictionary holding the "sampler", the "expect_op" and the "transpiled" ansatz
+                        (with the measurements for shot based backends) used for the final state
+            kwargs : Keyword arguments of the VQE
+        """
+        super().__init__(*args, **kwargs)
+        self._circuits = circuits if circuits is not None else {}
+
+        # The sampler runs its cached circuits on the quantum instance of this VQE
+        sampler = self._circuits.get("sampler")
+        if sampler is not None:
+            sampler.quantum_instance = self.quantum_instance
+            self._circuit_sampler = sampler
+        else:
+            self._circuits["sampler"] = self._circuit_sampler
+
+    def construct_expectation(self,
+                                parameter: Union[List[float], np.ndarray],
+                                operator: OperatorBase,
+                                return_expectation: bool = False,
+                                ) -> Union[OperatorBase, Tuple[OperatorBase, ExpectationBase]]:
+        unbound = list(parameter) == list(self.ansatz.parameters)
+        cached = self._circuits.get("expect_op")
+        if cached is None or not unbound or not _same_operator(cached[0], operator):
+            expect_op, expectation = super().construct_expectation(parameter, operator, return_expectation=True)
+            if not unbound:
+                return (expect_op, expectation) if return_expectation else expect_op
+            cached = (operator, expect_op, expectation)
+            self._circuits["expect_op"] = cached
+
+        _, expect_op, expectation = cached
+        return (expect_op, expectation) if return_expectation else expect_op
+
+    def _get_eigenstate(self, optimal_parameters: Dict) -> Union[List[float], Dict[str, float]]:
+        # The circuit sampler would drop its cached circuits to sample a new one
+        transpiled = self._circuits.get("transpiled")
+        if transpiled is None:
+            return super()._get_eigenstate(optimal_parameters)
+
+        circuit = transpiled.bind_parameters(dict(zip(transpiled.parameters, optimal_parameters.values())))
+        result = self.quantum_instance.execute(circuit, had_transpiled=True)
+        if self.quantum_instance.is_statevector:
+            return np.asarray(result.get_statevector(0))
+
+        # Square roots of the probabilities, as the VQE
+        counts = result.get_counts(0)
+        shots = sum(counts.values())
+        return {key: np.sqrt(value / shots) for key, value in counts.items()}
+
+def _same_operator(a: OperatorBase, b: OperatorBase) -> bool:
+    return a is b or a == b
@@ -17,8 +17,10 @@ import logging
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
+from scipy import sparse
 
 from qiskit_optimization.exceptions import QiskitOptimizationError
+from qiskit_optimization.problems.constraint import Constraint
 from qiskit_optimization.problems.quadratic_objective import QuadraticObjective
 from qiskit_optimization.problems.quadratic_program import QuadraticProgram
 from qiskit_optimization.problems.variable import Variable
@@ -39,8 +41,11 @@ class ContinuousToBinary(QuadraticProgramConverter):
         self._src = None  # type: Optional[QuadraticProgram]
         self._dst = None  # type: Optional[QuadraticProgram]
         self._conv = {}  # type: Dict[Variable, List[Tuple[str, int]]]
+        self._E = None  # type: Optional[sparse.csr_matrix]
+        self._shift = None  # type: Optional[np.ndarray]
 
         # e.g., self._conv = {x: [('x@1', 1), ('x@2', 2)]}
+        # and the source variables are x = E @ y + shift with y the destination variables
 
     def convert(self, problem: QuadraticProgram) -> QuadraticProgram:
         """Convert a continious problem into a new problem with binary variables.
@@ -63,14 +68,23 @@ class ContinuousToBinary(QuadraticProgramConverter):
             # Initialize new QP
             self._dst = QuadraticProgram(name=problem.name)
 
-            # Declare variables
-            for x in self._src.variables:
+            # Declare variables and build the encoding matrix
+            rows, cols, vals = [], [], []
+            self._shift = np.zeros(self._src.get_num_vars())
+            for i, x in enumerate(self._src.variables):
                 if x.vartype == Variable.Type.CONTINUOUS:
                     new_vars = self._convert_var(x.name, x.lowerbound, x.upperbound)
                     self._conv[x] = new_vars
-                    for (var_name, _) in new_vars:
+                    for (var_name, coeff) in new_vars:
+                        rows.append(i)
+                        cols.append(self._dst.get_num_vars())
+                        vals.append(coeff)
                         self._dst.binary_var(var_name)
+                    self._shift[i] = x.lowerbound
                 else:
+                    rows.append(i)
+                    cols.append(self._dst.get_num_vars())
+                    vals.append(1.0)
                     if x.vartype == Variable.Type.INTEGER:
                         self._dst.integer_var(x.lowerbound, x.upperbound, x.name)
                     elif x.vartype == Variable.Type.BINARY:
@@ -80,11 +94,17 @@ class ContinuousToBinary(QuadraticProgramConverter):
                             "Unsupported variable type {}".format(x.vartype)
                         )
 
+            self._E = sparse.csr_matrix(
+                (vals, (rows, cols)), shape=(self._src.get_num_vars(), self._dst.get_num_vars())
+            )
+
             self._substitute_cont_var()
 
         else:
             # just copy the problem if no continuous variables exist
             self._dst = copy.deepcopy(problem)
+            self._E = sparse.identity(self._src.get_num_vars(), format="csr")
+            self._shift = np.zeros(self._src.get_num_vars())
 
         return self._dst
 
@@ -99,72 +119,38 @@ class ContinuousToBinary(QuadraticProgramConverter):
         coeffs = [2**i for i in range(power)] + [bounded_coef]
         return [(name + self._delimiter + str(i), coef) for i, coef in enumerate(coeffs)]
 
-    def _convert_linear_coefficients_dict(
-            self, coefficients: Dict[str, float]
-    ) -> Tuple[Dict[str, float], float]:
-        constant = 0.0
-        linear = {}  # type: Dict[str, float]
-        for name, v in coefficients.items():
-            x = self._src.get_variable(name)
-            if x in self._conv:
-                for y, coeff in self._conv[x]:
-                    linear[y] = v * coeff
-                constant += v * x.lowerbound
-            else:
-                linear[x.name] = v
-
+    def _convert_linear_coefficients(
+            self, coefficients: sparse.spmatrix
+    ) -> Tuple[sparse.csr_matrix, float]:
+        # c^T x = c^T E y + c^T shift
+        coefficients = sparse.csr_matrix(coefficients)
+        linear = coefficients @ self._E
+        constant = (coefficients @ self._shift).sum()
         return linear, constant
 
-    def _convert_quadratic_coefficients_dict(
-            self, coefficients: Dict[Tuple[str, str], float]
-    ) -> Tuple[Dict[Tuple[str, str], float], Dict[str, float], float]:
-        constant = 0.0
-        linear = {}  # type: Dict[str, float]
-        quadratic = {}
-        for (name_i, name_j), v in coefficients.items():
-            x = self._src.get_variable(name_i)
-            y = self._src.get_variable(name_j)
-
-            if x in self._conv and y not in self._conv:
-                for z_x, coeff_x in self._conv[x]:
-                    quadratic[z_x, y.name] = v * coeff_x
-                linear[y.name] = linear.get(y.name, 0.0) + v * x.lowerbound
-
-            elif x not in self._conv and y in self._conv:
-                for z_y, coeff_y in self._conv[y]:
-                    quadratic[x.name, z_y] = v * coeff_y
-                linear[x.name] = linear.get(x.name, 0.0) + v * y.lowerbound
-
-            elif x in self._conv and y in self._conv:
-                for z_x, coeff_x in self._conv[x]:
-                    for z_y, coeff_y in self._conv[y]:
-                        quadratic[z_x, z_y] = v * coeff_x * coeff_y
-
-                for z_x, coeff_x in self._conv[x]:
-                    linear[z_x] = linear.get(z_x, 0.0) + v * y.lowerbound
-                for z_y, coeff_y in self._conv[y]:
-                    linear[z_y] = linear.get(z_y, 0.0) + v * x.lowerbound
-
-                constant += v * x.lowerbound * y.lowerbound
-
-            else:
-                quadratic[x.name, y.name] = v
-
-        return quadratic, linear, constant
+    def _convert_quadratic_coefficients(
+            self, coefficients: sparse.spmatrix
+    ) -> Tuple[sparse.csr_matrix, sparse.csr_matrix, float]:
+        # x^T Q x = y^T E^T Q E y + shift^T (Q + Q^T) E y + shift^T Q shift
+        coefficients = sparse.csr_matrix(coefficients)
+        quadratic = self._E.T @ coefficients @ self._E
+        linear = sparse.csr_matrix((coefficients + coefficients.T) @ self._shift) @ self._E
+        constant = self._shift @ (coefficients @ self._shift)
+        return quadratic.tocsr(), linear, constant
 
     def _substitute_cont_var(self):
 
         # set objective
-        linear, linear_constant = self._convert_linear_coefficients_dict(
-            self._src.objective.linear.to_dict(use_name=True)
+        linear, linear_constant = self._convert_linear_coefficients(
+            self._src.objective.linear.coefficients
         )
-        quadratic, q_linear, q_constant, = self._convert_quadratic_coefficients_dict(
-            self._src.objective.quadratic.to_dict(use_name=True)
+        quadratic, q_linear, q_constant = self._convert_quadratic_coefficients(
+            self._src.objective.quadratic.coefficients
         )
 
         constant = self._src.objective.constant + linear_constant + q_constant
-        for i, v in q_linear.items():
-            linear[i] = linear.get(i, 0) + v
+        linear = _prune(linear + q_linear)
+        quadratic = _prune(quadratic)
 
         if self._src.objective.sense == QuadraticObjective.Sense.MINIMIZE:
             self._dst.minimize(constant, linear, quadratic)
@@ -173,27 +159,25 @@ class ContinuousToBinary(QuadraticProgramConverter):
 
         # set linear constraints
         for constraint in self._src.linear_constraints:
-            linear, constant = self._convert_linear_coefficients_dict(
-                constraint.linear.to_dict(use_name=True))
+            linear, constant = self._convert_linear_coefficients(constraint.linear.coefficients)
             self._dst.linear_constraint(
-                linear, constraint.sense, constraint.rhs - constant, constraint.name
+                _prune(linear), constraint.sense, constraint.rhs - constant, constraint.name
             )
 
         # set quadratic constraints
         for constraint in self._src.quadratic_constraints:
-            linear, linear_constant = self._convert_linear_coefficients_dict(
-                constraint.linear.to_dict(use_name=True)
+            linear, linear_constant = self._convert_linear_coefficients(
+                constraint.linear.coefficients
             )
-            quadratic, q_linear, q_constant = self._convert_quadratic_coefficients_dict(
-                constraint.quadratic.to_dict(use_name=True)
+            quadratic, q_linear, q_constant = self._convert_quadratic_coefficients(
+                constraint.quadratic.coefficients
             )
 
             constant = linear_constant + q_constant
-            for i, v in q_linear.items():
-                linear[i] = linear.get(i, 0) + v
+            linear = _prune(linear + q_linear)
 
             self._dst.quadratic_constraint(
-                linear, quadratic, constraint.sense, constraint.rhs - constant, constraint.name
+                linear, _prune(quadratic), constraint.sense, constraint.rhs - constant, constraint.name
             )
 
     def interpret(self, result: OptimizationResult) \
@@ -219,11 +203,88 @@ class ContinuousToBinary(QuadraticProgramConverter):
 
     def _interpret_var(self, vals: Union[List[float], np.ndarray]) -> List[float]:
         # interpret continuous values
-        sol = {x.name: vals[i] for i, x in enumerate(self._dst.variables)}
-        new_vals = []
-        for x in self._src.variables:
-            if x in self._conv:
-                new_vals.append(sum(sol[aux] * coef for aux, coef in self._conv[x]) + x.lowerbound)
+        return (self._E @ np.asarray(vals, dtype=float) + self._shift).tolist()
+
+    def interpret_samples(
+            self, samples: Union[np.ndarray, Dict[str, int]]
+    ) -> Dict[str, np.ndarray]:
+        """Convert back a batch of samples of the converted problem (binary variables)
+        to the original (continuous variables), and evaluate them on the original problem.
+
+        Args:
+            samples: Either an array of shape (S, n_bits) with one sample per row, or a counts
+                dictionary whose keys are bitstrings in qiskit order (the rightmost bit is the
+                first variable).
+
+        Returns:
+            A dictionary with the samples "bits" (S, n_bits), the "counts" (S,) (ones for an
+            array), the original variables "x" (S, N), the objective values "fval" (S,) and the
+            total violation of the linear constraints "violation" (S,).
+
+        Raises:
+            QiskitOptimizationError: if the number of variables in the samples differs from
+                that of the converted problem.
+        """
+        if isinstance(samples, dict):
+            keys = [key.replace(" ", "") for key in samples]
+            num_bits = len(keys[0]) if keys else 0
+            bits = np.frombuffer("".join(keys).encode(), dtype=np.uint8).reshape(len(keys), num_bits)
+            bits = (bits - ord("0"))[:, ::-1].astype(float)
+            counts = np.array(list(samples.values()))
+        else:
+            bits = np.atleast_2d(np.asarray(samples, dtype=float))
+            counts = np.ones(bits.shape[0], dtype=int)
+
+        if bits.shape[1] != self._dst.get_num_vars():
+            raise QiskitOptimizationError(
+                "The number of variables in the passed samples differs from "
+                "that of the converted problem."
+            )
+
+        x = (self._E @ bits.T).T + self._shift
+
+        objective = self._src.objective
+        quadratic = sparse.csr_matrix(objective.quadratic.coefficients)
+        fval = (
+            objective.constant
+            + x @ objective.linear.to_array()
+            + np.einsum("si,si->s", x, (quadratic @ x.T).T)
+        )
+
+        violation = np.zeros(x.shape[0])
+        for constraint in self._src.linear_constraints:
+            residual = x @ constraint.linear.to_array() - constraint.rhs
+            if constraint.sense == Constraint.Sense.EQ:
+                violation += np.abs(residual)
+            elif constraint.sense == Constraint.Sense.LE:
+                violation += np.maximum(residual, 0.0)
             else:
-                new_vals.append(sol[x.name])
-        return new_vals
\ No newline at end of file
+                violation += np.maximum(-residual, 0.0)
+
+        return {"bits": bits, "counts": counts, "x": x, "fval": fval, "violation": violation}
+
+    def best_samples(
+            self, samples: Union[np.ndarray, Dict[str, int]], k: int = 1, tol: float = 1e-6
+    ) -> Dict[str, np.ndarray]:
+        """Select the k best feasible samples of a batch.
+
+        Args:
+            samples: Samples of the converted problem, as in interpret_samples.
+            k: Number of samples to keep.
+            tol: Tolerance on the violation of the linear constraints.
+
+        Returns:
+            The entries of interpret_samples restricted to the k best feasible samples, sorted
+            from the best objective value.
+        """
+        res = self.interpret_samples(samples)
+        feasible = np.flatnonzero(res["violation"] <= tol)
+        order = np.argsort(self._src.objective.sense.value * res["fval"][feasible], kind="stable")
+        selected = feasible[order[:k]]
+        return {key: val[selected] for key, val in res.items()}
+
+def _prune(mat: sparse.spmatrix) -> sparse.csr_matrix:
+    # Drop the explicit zeros so that the converted program only stores the nonzero terms
+    mat = sparse.csr_matrix(mat)
+    mat.eliminate_zeros()
+    return mat
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Matrix-native QUBO and Ising formulations of the portfolio problem."""
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+from qiskit.opflow import PauliSumOp
+from qiskit.quantum_info import PauliList, SparsePauliOp
+
+# Penalty used by qiskit-optimization when the constraint has non integer coefficients
+DEFAULT_PENALTY = 1e5
+
+def binary_encoding(var_range: float, num_bits: Optional[int] = None) -> ndarray:
+    """
+    Coefficients of the binary expansion of a continuous variable in [0, var_range], the same
+    as ContinuousToBinary: powers of two completed by a last coefficient reaching var_range.
+
+    Args:
+        var_range : Range of the continuous variable
+        num_bits : Number of bits (None = int(log2(var_range)) + 1, as ContinuousToBinary)
+    Returns:
+        coeffs : Coefficients of the expansion, of shape (num_bits,)
+    """
+    if num_bits is None:
+        num_bits = int(np.log2(var_range)) + 1
+    if num_bits < 1:
+        raise ValueError(f"num_bits should be at least 1, got {num_bits}")
+
+    power = num_bits - 1
+    coeffs = [2**i for i in range(power)] + [var_range - (2 ** power - 1)]
+    return np.array(coeffs, dtype=float)
+
+def encoding_matrix(N: int, coeffs: ndarray) -> ndarray:
+    """
+    Dense encoding matrix E such that w = E b, bits ordered asset by asset.
+
+    Args:
+        N : Number of assets
+        coeffs : Coefficients of the binary expansion of one asset
+    Returns:
+        E : Encoding matrix of shape (N, N * len(coeffs))
+    """
+    return np.kron(np.eye(N), coeffs)
+
+def portfolio_qubo(Cov: Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
+                    mu: ndarray,
+                    gamma: float = 0.1,
+                    budget: float = 1000,
+                    asset_limit: float = 1.0,
+                    num_bits: Optional[int] = None,
+                    penalty: Optional[float] = None,
+                    ) -> Tuple[ndarray, ndarray, float, float]:
+    """
+    QUBO b^T Q b + c^T b + offset of the portfolio problem, with the budget constraint added
+    as a penalty. It is the same problem as ContinuousToBinary followed by QuadraticProgramToQubo,
+    including the automatic penalty of qiskit-optimization.
+
+    Args:
+        Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
+        mu : Assets' forecasts returns
+        gamma : Risk aversion coefficient
+        budget : Maximum budget
+        asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
+        num_bits : Number of bits per asset (None = as ContinuousToBinary)
+        penalty : Penalty factor of the budget constraint (None = automatic)
+    Returns:
+        Q : Symmetric quadratic term
+        c : Linear term
+        offset : Constant term
+        penalty : Penalty factor used
+    """
+    if isinstance(Cov, tuple):
+        B, F, D = Cov
+        Cov = B @ F @ B.T + np.diag(D)
+
+    N = Cov.shape[0]
+    coeffs = binary_encoding(asset_limit * budget, num_bits)
+    E = encoding_matrix(N, coeffs)
+
+    # Objective
+    Q = E.T @ (gamma * 0.5 * Cov) @ E
+    c = -E.T @ mu
+
+    if penalty is None:
+        terms = np.append(coeffs, budget)
+        if np.any(terms != np.round(terms)):
+            penalty = DEFAULT_PENALTY
+        else:
+            # Range of the objective over the binary variables
+            penalty = 1.0 + np.abs(c).sum() + np.abs(Q).sum()
+
+    # Penalty * (budget - a^T b)^2 with a the coefficients of the budget constraint
+    a = E.sum(axis=0)
+    Q = Q + penalty * np.outer(a, a)
+    c = c - 2 * penalty * budget * a
+    offset = penalty * budget**2
+
+    return Q, c, offset, penalty
+
+def qubo_to_ising(Q: ndarray,
+                    c: ndarray,
+                    offset: float = 0.0,
+                    ) -> Tuple[ndarray, ndarray, float]:
+    """
+    Ising model sum_{i<j} J_ij Z_i Z_j + sum_i h_i Z_i + offset of a QUBO, with b_i = (1 - Z_i)/2.
+
+    Args:
+        Q : Symmetric quadratic term
+        c : Linear term
+        offset : Constant term
+    Returns:
+        J : Strictly upper triangular couplings
+        h : Local fields
+        offset : Constant term
+    """
+    J = np.triu(Q, k=1) / 2
+    h = -(c + Q.sum(axis=1)) / 2
+    offset = offset + c.sum() / 2 + (Q.sum() + np.trace(Q)) / 4
+    return J, h, offset
+
+def ising_operator(J: ndarray, h: ndarray) -> PauliSumOp:
+    """
+    Qubit operator of an Ising model, qubit i being the i-th binary variable.
+
+    Args:
+        J : Strictly upper triangular couplings
+        h : Local fields
+    Returns:
+        H : Hamiltonian without the constant term
+    """
+    n = h.shape[0]
+    I, K = np.nonzero(J)
+    fields = np.flatnonzero(h)
+
+    z = np.zeros((fields.shape[0] + I.shape[0], n), dtype=bool)
+    z[np.arange(fields.shape[0]), fields] = True
+    rows = fields.shape[0] + np.arange(I.shape[0])
+    z[rows, I] = True
+    z[rows, K] = True
+    coeffs = np.concatenate([h[fields], J[I, K]])
+
+    return z_operator(z, coeffs)
+
+def z_operator(z: ndarray, coeffs: ndarray) -> PauliSumOp:
+    """
+    Qubit operator sum_t coeffs[t] prod_{i, z[t, i]} Z_i.
+
+    Args:
+        z : Boolean masks of the Z terms, of shape (num_terms, num_qubits)
+        coeffs : Coefficients of the terms
+    Returns:
+        H : Hamiltonian
+    """
+    if coeffs.shape[0] == 0:
+        return PauliSumOp(SparsePauliOp("I" * max(1, z.shape[1]), coeffs=[0.0]))
+
+    paulis = PauliList.from_symplectic(z, np.zeros_like(z))
+    return PauliSumOp(SparsePauliOp(paulis, coeffs=np.asarray(coeffs).astype(complex)))
+
+def z_terms(H: PauliSumOp) -> Tuple[ndarray, ndarray]:
+    """
+    Z masks and coefficients of a diagonal qubit operator, the inverse of z_operator.
+
+    Args:
+        H : Hamiltonian made of I and Z terms
+    Returns:
+        z : Boolean masks of the Z terms, of shape (num_terms, num_qubits)
+        coeffs : Real coefficients of the terms
+    """
+    op = H.primitive
+    if np.any(op.paulis.x):
+        raise ValueError("The Hamiltonian should only contain I and Z terms")
+    return op.paulis.z.copy(), np.real(op.coeffs * H.coeff)
+
+def z_terms_to_ising(z: ndarray, coeffs: ndarray) -> Tuple[ndarray, ndarray, float]:
+    """
+    Ising model of a Hamiltonian given by its Z terms, as returned by z_terms.
+
+    Args:
+        z : Boolean masks of the Z terms, of shape (num_terms, num_qubits)
+        coeffs : Real coefficients of the terms
+    Returns:
+        J : Strictly upper triangular couplings
+        h : Local fields
+        offset : Coefficient of the identity
+    """
+    n = z.shape[1]
+    order = z.sum(axis=1)
+    if np.any(order > 2):
+        raise ValueError("The Hamiltonian should only contain terms with at most two Z")
+
+    h = coeffs[order == 1] @ z[order == 1]
+    J = np.zeros((n, n))
+    pairs = z[order == 2]
+    I = np.argmax(pairs, axis=1)
+    K = n - 1 - np.argmax(pairs[:, ::-1], axis=1)
+    np.add.at(J, (I, K), coeffs[order == 2])
+    return J, h, float(coeffs[order == 0].sum())
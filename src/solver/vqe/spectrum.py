@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Diagonal energy spectrum of Ising Hamiltonians and the matching VQE expectation."""
+
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+from qiskit.circuit import ParameterExpression
+from qiskit.opflow import (CircuitStateFn, DictStateFn, ExpectationBase, ListOp,
+                           OperatorBase, OperatorStateFn, PauliExpectation, VectorStateFn)
+from qiskit.opflow.state_fns.cvar_measurement import CVaRMeasurement
+from qiskit.quantum_info import Statevector
+
+# Largest spectrum held in memory, 2^29 energies in float64
+MAX_SPECTRUM_BYTES = 1 << 32
+
+def ising_spectrum(J: ndarray,
+                    h: ndarray,
+                    offset: float = 0.0,
+                    chunk_qubits: int = 20,
+                    dtype: type = np.float64,
+                    path: Optional[str] = None,
+                    ) -> ndarray:
+    """
+    Energies sum_{i<j} J_ij s_i s_j + sum_i h_i s_i + offset of the 2^n basis states, where
+    s_i = 1 - 2 b_i and b_i is the i-th bit of the basis state index (qiskit ordering).
+    The spectrum is built chunk by chunk of 2^chunk_qubits states by doubling the number of qubits,
+    so the cost is linear in 2^n. Only the build is chunked: the 2^n energies are stored in memory,
+    up to MAX_SPECTRUM_BYTES, or in a memory-mapped .npy file when a path is given.
+
+    Args:
+        J : Strictly upper triangular couplings
+        h : Local fields
+        offset : Constant term
+        chunk_qubits : Number of low qubits enumerated in one chunk
+        dtype : Type of the energies
+        path : Path of a .npy file the energies are written to (None = in memory)
+    Returns:
+        energies : Energy of each basis state, of shape (2^n,), a memory map if path is given
+    """
+    n = h.shape[0]
+    c = min(n, chunk_qubits)
+    J = np.triu(J, k=1)
+    Jsym = J + J.T
+
+    # Energies of the low qubits, then their coupling with each assignment of the high ones
+    low = _ising_doubling(Jsym[:c, :c], h[:c])
+    if path is not None:
+        energies = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(2**n,))
+    else:
+        nbytes = 2**n * np.dtype(dtype).itemsize
+        if nbytes > MAX_SPECTRUM_BYTES:
+            raise ValueError(f"The spectrum of {n} qubits needs {nbytes / 2**30:.1f} GiB, give a path to store it on disk.")
+        energies = np.empty(2**n, dtype=dtype)
+    for high in range(2**(n - c)):
+        s = 1 - 2 * ((high >> np.arange(n - c)) & 1)
+        high_energy = h[c:] @ s + s @ J[c:, c:] @ s + offset
+        energies[high << c: (high + 1) << c] = low + _linear_doubling(Jsym[:c, c:] @ s) + high_energy
+
+    if path is not None:
+        energies.flush()
+    return energies
+
+def expectation(spectrum: ndarray, state: Union[ndarray, Statevector, Dict[str, int]]) -> Union[float, ndarray]:
+    """
+    Expectation of a diagonal Hamiltonian from its spectrum.
+
+    Args:
+        spectrum : Energy of each basis state
+        state : Statevector, batch of statevectors of shape (B, 2^n), or counts dictionary
+                with bitstrings in qiskit order
+    Returns:
+        value : Expectation value, or one value per statevector of the batch
+    """
+    if isinstance(state, dict):
+        index, weights = _histogram(state)
+        return float(weights @ spectrum[index] / weights.sum())
+
+    if isinstance(state, Statevector):
+        state = state.data
+    probabilities = np.abs(state)**2
+    return probabilities @ spectrum
+
+def sampled_expectation(z: ndarray, coeffs: ndarray, counts: Dict[str, int]) -> float:
+    """
+    Expectation of a diagonal Hamiltonian given by its Z terms over sampled bitstrings, without
+    the spectrum: only the energies of the observed basis states are computed.
+
+    Args:
+        z : Boolean masks of the Z terms, of shape (num_terms, num_qubits)
+        coeffs : Real coefficients of the terms
+        counts : Counts dictionary with bitstrings in qiskit order
+    Returns:
+        value : Expectation value
+    """
+    index, weights = _histogram(counts)
+    bits = (index[:, None] >> np.arange(z.shape[1])) & 1
+    energies = (1 - 2 * ((bits @ z.T.astype(np.int64)) % 2)) @ coeffs
+    return float(weights @ energies / weights.sum())
+
+class SpectrumMeasurement(CVaRMeasurement):
+    """
+    Measurement of a diagonal Hamiltonian whose energies are looked up in its precomputed spectrum.
+    """
+
+    def __init__(self,
+                primitive: OperatorBase,
+                spectrum: ndarray,
+                alpha: float = 1.0,
+                coeff: Union[complex, ParameterExpression] = 1.0,
+                ) -> None:
+        """
+        Args:
+            primitive : Diagonal Hamiltonian
+            spectrum : Energy of each basis state of the Hamiltonian
+            alpha : CVaR quantile (1 = expectation value)
+            coeff : Coefficient of the measurement
+        """
+        self._spectrum = spectrum
+        super().__init__(primitive, alpha=alpha, coeff=coeff)
+
+    def eval(self, front=None) -> complex:
+        if self.alpha < 1:
+            return super().eval(front)
+        index, probabilities = self._probabilities(front)
+        return self.coeff * (probabilities @ self._spectrum[index])
+
+    def get_outcome_energies_probabilities(self, front=None) -> Tuple[list, list]:
+        index, probabilities = self._probabilities(front)
+        energies = self._spectrum[index]
+        order = np.argsort(energies, kind="stable")
+        return energies[order].tolist(), probabilities[order].tolist()
+
+    def mul(self, scalar: Union[complex, ParameterExpression]) -> "SpectrumMeasurement":
+        return SpectrumMeasurement(self.primitive, self._spectrum, alpha=self.alpha, coeff=self.coeff * scalar)
+
+    def traverse(self, convert_fn, coeff=None) -> OperatorBase:
+        if coeff is None:
+            coeff = self.coeff
+        return SpectrumMeasurement(convert_fn(self.primitive), self._spectrum, alpha=self.alpha, coeff=coeff)
+
+    def _probabilities(self, front) -> Tuple[ndarray, ndarray]:
+        if isinstance(front, CircuitStateFn):
+            front = front.eval()
+
+        if isinstance(front, DictStateFn):
+            # The sampler stores the square roots of the probabilities
+            index, roots = _histogram(front.primitive)
+            return index, np.abs(roots)**2 / np.sum(np.abs(roots)**2)
+        if isinstance(front, VectorStateFn):
+            probabilities = np.abs(front.primitive.data)**2
+            return np.arange(probabilities.shape[0]), probabilities
+        raise ValueError("Unsupported input to SpectrumMeasurement.eval:", type(front))
+
+class SpectrumExpectation(ExpectationBase):
+    """
+    Expectation converter replacing the measurement of a diagonal Hamiltonian by a lookup in its
+    precomputed spectrum. Other measurements are converted with the PauliExpectation.
+    """
+
+    def __init__(self, operator: OperatorBase, spectrum: ndarray, alpha: float = 1.0) -> None:
+        """
+        Args:
+            operator : Diagonal Hamiltonian
+            spectrum : Energy of each basis state of the Hamiltonian
+            alpha : CVaR quantile (1 = expectation value)
+        """
+        self.operator = operator
+        self.spectrum = spectrum
+        self.alpha = alpha
+        self.expectation = PauliExpectation()
+
+    def convert(self, operator: OperatorBase) -> OperatorBase:
+        if isinstance(operator, OperatorStateFn) and operator.is_measurement:
+            if operator.primitive is self.operator or operator.primitive == self.operator:
+                return SpectrumMeasurement(operator.primitive, self.spectrum, alpha=self.alpha, coeff=operator.coeff)
+            return self.expectation.convert(operator)
+        elif isinstance(operator, ListOp):
+            return operator.traverse(self.convert)
+        return operator
+
+    def compute_variance(self, exp_op: OperatorBase) -> Union[list, float]:
+        def variance(op):
+            if isinstance(op, ListOp) and len(op.oplist) == 2 and isinstance(op.oplist[0], SpectrumMeasurement):
+                return np.real(op.oplist[0].eval_variance(op.oplist[1]))
+            elif isinstance(op, ListOp):
+                return op.combo_fn([variance(child) for child in op.oplist])
+            return 0.0
+
+        return variance(exp_op)
+
+def _histogram(counts: Dict[str, Union[int, float, complex]]) -> Tuple[ndarray, ndarray]:
+    # Bitstrings are in qiskit order, so their integer value is the basis state index
+    index = np.array([int(key.replace(" ", ""), 2) for key in counts], dtype=np.int64)
+    weights = np.array(list(counts.values()))
+    return index, weights
+
+def _linear_doubling(g: ndarray) -> ndarray:
+    # sum_i g_i s_i for every assignment of the spins, qubit i being the i-th bit
+    values = np.zeros(1)
+    for gi in g:
+        values = np.concatenate([values + gi, values - gi])
+    return values
+
+def _ising_doubling(Jsym: ndarray, h: ndarray) -> ndarray:
+    # Add the qubits one at a time: qubit i contributes s_i (h_i + sum_{j<i} J_ij s_j)
+    energies = np.zeros(1)
+    for i in range(h.shape[0]):
+        field = h[i] + _linear_doubling(Jsym[:i, i])
+        energies = np.concatenate([energies + field, energies - field])
+    return energies
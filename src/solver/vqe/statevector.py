@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Adel Sohbi, https://github.com/adelshb.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+""" Batched NumPy statevector simulator of the TwoLocal ry/rz/cz ansatz."""
+
+from typing import Callable, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from qiskit.circuit.library import TwoLocal
+
+class TwoLocalSimulator():
+    """
+    Statevectors of TwoLocal(num_qubits, ['ry', 'rz'], 'cz', reps, entanglement='full') for a batch
+    of parameter vectors. Each rotation layer is applied as one batched 2x2 gate per qubit, and
+    each full CZ layer as one diagonal phase vector (-1)^(k(k-1)/2), k being the number of ones
+    of the basis state. Basis states are indexed as in qiskit: qubit i is the i-th bit.
+    """
+
+    def __init__(self, num_qubits: int, reps: int = 1) -> None:
+        """
+        Args:
+            num_qubits : Number of qubits
+            reps : Number of entanglement layers of the ansatz
+        """
+
+        self.num_qubits = num_qubits
+        self.reps = reps
+        self.num_parameters = 2 * num_qubits * (reps + 1)
+
+        ones = np.zeros(1, dtype=np.int64)
+        for _ in range(num_qubits):
+            ones = np.concatenate([ones, ones + 1])
+        self._phase = 1 - 2 * ((ones * (ones - 1) // 2) % 2)
+
+    @classmethod
+    def from_ansatz(cls, ansatz: TwoLocal) -> "TwoLocalSimulator":
+        """
+        Simulator of a qiskit TwoLocal ansatz.
+        Args:
+            ansatz : TwoLocal ansatz with ['ry', 'rz'] rotations and full 'cz' entanglement
+        Returns:
+            simulator : Simulator with the same parameters, in the order of ansatz.parameters
+        """
+
+        supported = (
+            isinstance(ansatz, TwoLocal)
+            and [b.data[0].operation.name for b in ansatz.rotation_blocks] == ["ry", "rz"]
+            and [b.data[0].operation.name for b in ansatz.entanglement_blocks] == ["cz"]
+            and ansatz.entanglement == "full"
+            and ansatz.initial_state is None
+            and ansatz.num_parameters == 2 * ansatz.num_qubits * (ansatz.reps + 1)
+            and list(ansatz.parameters) == list(ansatz.ordered_parameters)
+            )
+        if not supported:
+            raise ValueError("Only TwoLocal(['ry', 'rz'], 'cz', entanglement='full') ansatze are supported")
+
+        return cls(ansatz.num_qubits, ansatz.reps)
+
+    def statevectors(self, params: ndarray) -> ndarray:
+        """
+        Args:
+            params : Parameter vector of shape (P,), or batch of shape (B, P)
+        Returns:
+            states : Statevectors of shape (2^n,), or (B, 2^n)
+        """
+
+        single = np.ndim(params) == 1
+        params = np.atleast_2d(params)
+        n = self.num_qubits
+        B = params.shape[0]
+        layers = params.reshape(B, self.reps + 1, 2, n)
+
+        # The first rotation layer acts on |0...0>, so the state is a product state
+        state = np.ones((B, 1), dtype=complex)
+        for i in range(n):
+            U = _rotations(layers[:, 0, 0, i], layers[:, 0, 1, i])
+            state = np.concatenate([state * U[:, 0, 0, None], state * U[:, 1, 0, None]], axis=1)
+
+        for r in range(1, self.reps + 1):
+            state = state * self._phase
+            for i in range(n):
+                state = _apply(state, _rotations(layers[:, r, 0, i], layers[:, r, 1, i]), i, n)
+
+        return state[0] if single else state
+
+    def gradient(self, params: ndarray, spectrum: ndarray) -> Tuple[ndarray, ndarray]:
+        """
+        Energies <psi|H|psi> of a diagonal Hamiltonian and their gradients with the adjoint method:
+        the state and the adjoint state H|psi> are propagated back through the circuit once, so the
+        cost is a few statevector simulations whatever the number of parameters.
+        Args:
+            params : Parameter vector of shape (P,), or batch of shape (B, P)
+            spectrum : Energy of each basis state of the Hamiltonian
+        Returns:
+            energies : Energies of shape (B,) or a float for a single vector
+            gradients : Gradients of shape (B, P), or (P,) for a single vector
+        """
+
+        single = np.ndim(params) == 1
+        params = np.atleast_2d(params)
+        n = self.num_qubits
+        B = params.shape[0]
+        layers = params.reshape(B, self.reps + 1, 2, n)
+
+        phi = self.statevectors(params)
+        lam = phi * spectrum
+        energies = np.real(np.sum(np.conj(phi) * lam, axis=1))
+
+        # Generators -i/2 Y and -i/2 Z of the rotations
+        gen_y = np.broadcast_to(np.array([[0, -0.5], [0.5, 0]], dtype=complex), (B, 2, 2))
+        gen_z = np.broadcast_to(np.array([[-0.5j, 0], [0, 0.5j]]), (B, 2, 2))
+
+        grads = np.zeros((B, self.reps + 1, 2, n))
+        for r in range(self.reps, -1, -1):
+            for i in range(n - 1, -1, -1):
+                rz = _rotations(np.zeros(B), layers[:, r, 1, i])
+                ry = _rotations(layers[:, r, 0, i], np.zeros(B))
+
+                grads[:, r, 1, i] = 2 * np.real(np.sum(np.conj(lam) * _apply(phi, gen_z, i, n), axis=1))
+                phi = _apply(phi, _dagger(rz), i, n)
+                lam = _apply(lam, _dagger(rz), i, n)
+
+                grads[:, r, 0, i] = 2 * np.real(np.sum(np.conj(lam) * _apply(phi, gen_y, i, n), axis=1))
+                phi = _apply(phi, _dagger(ry), i, n)
+                lam = _apply(lam, _dagger(ry), i, n)
+
+            if r > 0:
+                phi = phi * self._phase
+                lam = lam * self._phase
+
+        grads = grads.reshape(B, -1)
+        return (float(energies[0]), grads[0]) if single else (energies, grads)
+
+def parameter_shift(energy: Callable[[ndarray], ndarray], params: ndarray) -> ndarray:
+    """
+    Gradient of an energy by the parameter-shift rule (E(p + pi/2 e_k) - E(p - pi/2 e_k)) / 2, exact
+    for circuits where each parameter is the angle of a single Pauli rotation. All 2P shifted
+    parameter vectors are evaluated in one batch.
+    Args:
+        energy : Function evaluating a batch of parameter vectors of shape (B, P)
+        params : Parameter vector of shape (P,)
+    Returns:
+        gradient : Gradient of shape (P,)
+    """
+
+    P = params.shape[0]
+    shifts = np.pi / 2 * np.eye(P)
+    values = np.asarray(energy(np.concatenate([params + shifts, params - shifts])))
+    return (values[:P] - values[P:]) / 2
+
+def _dagger(U: ndarray) -> ndarray:
+    return np.conj(np.swapaxes(U, -1, -2))
+
+def _rotations(theta: ndarray, phi: ndarray) -> ndarray:
+    # RZ(phi) RY(theta) for each element of the batch, of shape (B, 2, 2)
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    em, ep = np.exp(-0.5j * phi), np.exp(0.5j * phi)
+    return np.stack([np.stack([em * c, -em * s], axis=-1), np.stack([ep * s, ep * c], axis=-1)], axis=-2)
+
+def _apply(state: ndarray, U: ndarray, qubit: int, n: int) -> ndarray:
+    # Apply a batch of single qubit gates on one qubit, which is the bit of weight 2^qubit
+    B = state.shape[0]
+    view = state.reshape(B, 2 ** (n - 1 - qubit), 2, 2 ** qubit)
+    return np.matmul(U[:, None], view).reshape(B, -1)
@@ -12,22 +12,38 @@
 
 """ VQE Optimization Method."""
 
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from numpy import ndarray 
 
 from qiskit_optimization import QuadraticProgram
 from qiskit_optimization.converters import QuadraticProgramToQubo
-from qiskit.algorithms import VQE
+from qiskit.circuit import QuantumCircuit
+from qiskit.quantum_info import Statevector
 
+from .cached_vqe import CachedVQE
 from .continuous_to_binary import ContinuousToBinary
+from .qubo import binary_encoding, ising_operator, portfolio_qubo, qubo_to_ising, z_operator, z_terms, z_terms_to_ising
+from .spectrum import SpectrumExpectation, expectation, ising_spectrum, sampled_expectation
+from .statevector import TwoLocalSimulator, parameter_shift
+from solver.cache import ArtifactCache
 
 class VQESolver():
         """
         Class for VQE Solver for Portfolio Optimization
         """
 
+        def __init__(self) -> None:
+                self._ansatz = None
+                self._circuits = {}
+                self._backend = "qiskit"
+                self._J = None
+                self._h = None
+                self._H = None
+                self._terms = None
+                self._spectrum = None
+
         # def qp(self, 
         #         Cov: ndarray,
         #         mu: ndarray,
@@ -54,7 +70,7 @@ class VQESolver():
         #         self._qp.minimize(constant=0.0, linear=-mu , quadratic=gamma*self._Cov/2)
 
         def qp(self, 
-                Cov: ndarray,
+                Cov: Union[ndarray, Tuple[ndarray, ndarray, ndarray]],
                 mu: ndarray,
                 gamma: float = 0.1,
                 budget: float = 1000,
@@ -63,14 +79,22 @@ class VQESolver():
                 """
                 Portfolio formulation in a qiskit QuadraticProgram.
                 Args:
-                        Cov : Covariance matrix
+                        Cov : Covariance matrix, or factor model (B, F, D) with Cov = B F B^T + diag(D)
                         mu : Assets' forecasts returns
                         gamma : Risk aversion coefficient
                         budget : Maximum budget
                         asset_limit : Maximum fraction of budget allocation per asset (1 = no limit)
                 """
+                # The QuadraticProgram holds a dense quadratic term
+                if isinstance(Cov, tuple):
+                        B, F, D = Cov
+                        Cov = B @ F @ B.T + np.diag(D)
+
                 self._Cov = Cov
                 self._mu = mu
+                self._gamma = gamma
+                self._budget = budget
+                self._asset_limit = asset_limit
                 self._N = Cov.shape[0]
 
                 self._qp = QuadraticProgram('portfolio_optimization')
@@ -82,55 +106,342 @@ class VQESolver():
                         quadratic=gamma * 0.5 * self._Cov
                         )
 
-        def to_ising(self)-> None:
+        def to_ising(self, method: str = "numpy", num_bits: Optional[int] = None, cache: Optional[ArtifactCache] = None)-> None:
                 """
                 Convert a QP to a Ising.
+                Args:
+                        method : "numpy" builds the QUBO and the Ising model with array algebra, "qiskit" goes through the QuadraticProgram converters
+                        num_bits : Number of bits per asset (None = as ContinuousToBinary, only for the "numpy" method)
+                        cache : Artifact cache where the Ising model is looked up before being built. After a cache hit
+                                the qubo is not available (None), whatever the method
                 """
 
-                # Convert continous variables to binary
-                con2bin = ContinuousToBinary()
-                qp_bin = con2bin.convert(self._qp)
+                __available_methods = ["numpy", "qiskit"]
+                if method not in __available_methods:
+                        raise ValueError(f"method should be one of {__available_methods}")
+
+                if cache is not None:
+                        encoding = binary_encoding(self._asset_limit * self._budget, num_bits if method == "numpy" else None)
+                        key = ArtifactCache.key(self._Cov, self._mu, self._gamma, self._budget, self._asset_limit, encoding=encoding)
+                        artifacts = cache.get(key)
+                        if artifacts is not None:
+                                self.load_ising(artifacts["z"], artifacts["coeffs"], float(artifacts["offset"]),
+                                        penalty=float(artifacts["penalty"]), encoding=artifacts["encoding"],
+                                        J=artifacts.get("J"), h=artifacts.get("h"))
+                                return self.H, self._offset
+
+                if method == "numpy":
+                        Q, c, offset, penalty = portfolio_qubo(self._Cov, self._mu, self._gamma, self._budget, self._asset_limit, num_bits=num_bits)
+                        J, h, offset = qubo_to_ising(Q, c, offset)
+                        H = ising_operator(J, h)
+
+                        self._qubo = None
+                        self._encoding = binary_encoding(self._asset_limit * self._budget, num_bits)
+                        self._penalty = penalty
+                        self._J = J
+                        self._h = h
+
+                else:
+                        # Convert continous variables to binary
+                        con2bin = ContinuousToBinary()
+                        qp_bin = con2bin.convert(self._qp)
+
+                        # Convert to QUBO then to Ising
+                        conv = QuadraticProgramToQubo()
+                        self._qubo = conv.convert(qp_bin)
 
-                # Convert to QUBO then to Ising
-                conv = QuadraticProgramToQubo()
-                self._qubo = conv.convert(qp_bin)
+                        H, offset = self._qubo.to_ising()
 
-                H, offset = self._qubo.to_ising()
+                        self._encoding = binary_encoding(self._asset_limit * self._budget)
+                        self._penalty = conv.penalty
+                        self._J = None
+                        self._h = None
 
                 self._H = H
+                self._terms = None
                 self._offset = offset
                 self._num_qubits = H.num_qubits
+                self._spectrum = None
+
+                if cache is not None:
+                        z, coeffs = z_terms(H)
+                        ising = {"J": self._J, "h": self._h} if self._J is not None else {}
+                        cache.put(key, z=z, coeffs=coeffs, offset=offset, penalty=self._penalty, encoding=self._encoding, **ising)
 
-                print(H)
                 return H, offset
 
-        def vqe_instance(self, ansatz, optimizer, quantum_instance, init=ndarray, callback=Callable):
+        def load_ising(self,
+                z: ndarray,
+                coeffs: ndarray,
+                offset: float,
+                penalty: Optional[float] = None,
+                encoding: Optional[ndarray] = None,
+                spectrum: Optional[ndarray] = None,
+                J: Optional[ndarray] = None,
+                h: Optional[ndarray] = None,
+                ) -> None:
+                """
+                Set an Ising model computed elsewhere, e.g. read from a cache or shared by another process.
+                The qubo is not available afterwards, and the Hamiltonian operator is only built on first use,
+                so the Z terms and the spectrum are enough for the "numpy" backend.
+                Args:
+                        z : Boolean masks of the Z terms of the Hamiltonian, of shape (num_terms, num_qubits)
+                        coeffs : Coefficients of the terms
+                        offset : Offset after convertion to Ising
+                        penalty : Penalty factor of the budget constraint
+                        encoding : Coefficients of the binary expansion of one asset
+                        spectrum : Precomputed energy spectrum of the Hamiltonian
+                        J : Strictly upper triangular couplings of the Hamiltonian, used to build the spectrum
+                        h : Local fields of the Hamiltonian
+                """
+                self._qubo = None
+                self._encoding = encoding
+                self._penalty = penalty
+                self._J = J
+                self._h = h
+                self._H = None
+                self._terms = (z, coeffs)
+                self._offset = offset
+                self._num_qubits = z.shape[1]
+                self._spectrum = spectrum
+
+        def spectrum(self, chunk_qubits: int = 20, dtype: type = np.float64, path: Optional[str] = None) -> ndarray:
+                """
+                Precompute the energy of every basis state of the Ising Hamiltonian (without the offset).
+                Once computed, the VQE expectations are looked up in it. The 2^n energies are stored in full
+                (8 GiB for 30 qubits in float64): above MAX_SPECTRUM_BYTES a path is needed to store them on disk.
+                Args:
+                        chunk_qubits : Number of low qubits enumerated in one chunk (2^chunk_qubits energies in memory at once)
+                        dtype : Type of the energies (2^n values are stored)
+                        path : Path of a .npy file the energies are memory-mapped to (None = in memory)
+                Returns:
+                        spectrum : Energy of each basis state, qubit i being the i-th bit of the index
+                """
+                if self._J is not None:
+                        J, h, constant = self._J, self._h, 0.0
+                else:
+                        J, h, constant = z_terms_to_ising(*self._z_terms())
+
+                self._spectrum = ising_spectrum(J, h, offset=constant, chunk_qubits=chunk_qubits, dtype=dtype, path=path)
+                return self._spectrum
+
+        def expectation(self, state: Union[ndarray, Dict[str, int]]) -> Union[float, ndarray]:
+                """
+                Expectation of the Ising Hamiltonian (without the offset). Statevectors are evaluated with the
+                spectrum, computed if needed. Counts use the spectrum if it was precomputed, otherwise only the
+                sampled bitstrings are evaluated.
+                Args:
+                        state : Statevector, batch of statevectors of shape (B, 2^n), or counts dictionary
+                Returns:
+                        value : Expectation value, or one value per statevector of the batch
+                """
+                if self._spectrum is None:
+                        if isinstance(state, dict):
+                                return sampled_expectation(*self._z_terms(), state)
+                        self.spectrum()
+                return expectation(self._spectrum, state)
+
+        def vqe_instance(self, ansatz, optimizer, quantum_instance, init=ndarray, callback=Callable, backend: str = "qiskit", gradient: Optional[str] = None, circuits: Optional[Dict] = None, expectation: str = "pauli", rng: Optional[np.random.Generator] = None):
+                """
+                Prepare the VQE.
+                Args:
+                        ansatz : Parametrized circuit
+                        optimizer : Classical optimizer
+                        quantum_instance : Quantum instance running the circuits (unused by the "numpy" backend)
+                        init : Initial parameters
+                        callback : Called with (eval_count, parameters, mean, std) at each evaluation
+                        backend : "qiskit" runs qiskit's VQE on the quantum instance, "numpy" simulates the
+                                TwoLocal ry/rz/cz ansatz with the batched NumPy statevector simulator
+                        gradient : None (the optimizer uses finite differences if it needs a gradient), "adjoint" for
+                                statevector runs of the TwoLocal ry/rz/cz ansatz, or "parameter_shift" evaluating the
+                                2P shifted circuits as one batch
+                        circuits : Entry of a CircuitCache for this ansatz, quantum instance and Hamiltonian, where the transpiled
+                                ansatz and the expectation operator are kept between instances (None = transpiled for this instance)
+                        expectation : Expectations of the "qiskit" backend, "pauli" measures the Pauli terms of H with qiskit's
+                                expectation, "spectrum" looks the energies up in the spectrum, computed if needed. Both agree up to
+                                rounding only, so the optimizer can take different paths. The "numpy" backend always uses the spectrum
+                        rng : Random generator of the initial parameters of the "numpy" backend when init is not an array
+                                (None = the global NumPy generator)
+                """
+
+                __available_backends = ["qiskit", "numpy"]
+                if backend not in __available_backends:
+                        raise ValueError(f"backend should be one of {__available_backends}")
+                __available_gradients = [None, "adjoint", "parameter_shift"]
+                if gradient not in __available_gradients:
+                        raise ValueError(f"gradient should be one of {__available_gradients}")
+                if gradient == "adjoint" and backend == "qiskit" and not quantum_instance.is_statevector:
+                        raise ValueError("The adjoint gradient needs a statevector simulation.")
+                __available_expectations = ["pauli", "spectrum"]
+                if expectation not in __available_expectations:
+                        raise ValueError(f"expectation should be one of {__available_expectations}")
+
+                self._ansatz = ansatz
+                self._optimizer = optimizer
+                self._quantum_instance = quantum_instance
+                self._init = init
+                self._callback = callback
+                self._backend = backend
+                self._gradient = gradient
+                self._rng = rng
+                self._simulator = TwoLocalSimulator.from_ansatz(ansatz) if backend == "numpy" or gradient == "adjoint" else None
 
-                vqe = VQE(ansatz = ansatz,
+                self._circuits = circuits if circuits is not None and backend == "qiskit" else {}
+                self._transpiled = self._circuits.get("transpiled")
+
+                if backend == "numpy":
+                        self._vqe = None
+                        return
+
+                measurement = None
+                if expectation == "spectrum":
+                        if self._spectrum is None:
+                                self.spectrum()
+                        measurement = SpectrumExpectation(self.H, self._spectrum)
+
+                vqe = CachedVQE(ansatz = ansatz,
                         optimizer = optimizer,
                         initial_point = init,
-                        gradient = None,
-                        expectation = None,
+                        gradient = self.gradient if gradient is not None else None,
+                        expectation = measurement,
                         include_custom = False,
                         max_evals_grouped = 1,
                         callback = callback,
-                        quantum_instance = quantum_instance)
+                        quantum_instance = quantum_instance,
+                        circuits = self._circuits)
         
                 self._vqe = vqe
 
+                # Shared entries also keep the transpiled ansatz for the final state
+                if circuits is not None:
+                        self._template()
+
         def solve(self) -> None:
-                res = self._vqe.compute_minimum_eigenvalue(self._H)
+                if self._backend == "numpy":
+                        return self._solve_numpy()
+                res = self._vqe.compute_minimum_eigenvalue(self.H)
                 return  res.optimal_value + self._offset
 
-        def eval(self, params: ndarray) -> float:
-                ## 
-                # TO DO
-                ##
-                raise ValueError('Not implemented yet.')
+        def _solve_numpy(self) -> float:
+                """
+                Minimize the energy with the optimizer of the VQE instance on the NumPy simulator.
+                """
+                if self._spectrum is None:
+                        self.spectrum()
+
+                x0 = self._init
+                if not isinstance(x0, ndarray):
+                        rng = self._rng if self._rng is not None else np.random
+                        x0 = rng.uniform(-2 * np.pi, 2 * np.pi, self._simulator.num_parameters)
+
+                eval_count = 0
+                def energy(params):
+                        nonlocal eval_count
+                        value = float(self.expectation(self._simulator.statevectors(params)))
+                        eval_count += 1
+                        if self._callback not in (None, Callable):
+                                self._callback(eval_count, params, value, 0.0)
+                        return value
+
+                jac = self.gradient if self._gradient is not None else None
+                res = self._optimizer.minimize(fun=energy, x0=x0, jac=jac)
+                return res.fun + self._offset
+
+        def gradient(self, params: ndarray) -> ndarray:
+                """
+                Gradient of the energy with the method chosen in vqe_instance.
+                Args:
+                        params : Parameter vector of shape (P,)
+                Returns:
+                        gradient : Gradient of shape (P,)
+                """
+                if self._spectrum is None:
+                        self.spectrum()
+                if self._gradient == "adjoint":
+                        return self._simulator.gradient(np.asarray(params), self._spectrum)[1]
+                return parameter_shift(lambda batch: self.eval(batch), np.asarray(params))
+
+        def eval(self, params: ndarray, return_expectation: bool = True, method: Optional[str] = None) -> Union[float, ndarray, List]:
+                """
+                Evaluate the ansatz of the VQE instance on one or a batch of parameter vectors.
+                Args:
+                        params : Parameter vector of shape (P,), or batch of shape (B, P)
+                        return_expectation : Return the energies, otherwise the statevectors or the counts
+                        method : "qiskit" runs the whole batch as one job on the quantum instance, transpiling the ansatz only once,
+                                "statevector" simulates it in NumPy with qiskit's Statevector, without any backend,
+                                "numpy" uses the batched TwoLocal simulator (None = the backend of the VQE instance)
+                Returns:
+                        values : Energies (expectation of H plus the offset) of shape (B,) or a float for a single vector,
+                                or the statevectors (B, 2^n) or the list of counts when return_expectation is False
+                """
+
+                if self._ansatz is None:
+                        raise ValueError("No ansatz, call vqe_instance first.")
+                if method is None:
+                        method = self._backend
+
+                __available_methods = ["qiskit", "statevector", "numpy"]
+                if method not in __available_methods:
+                        raise ValueError(f"method should be one of {__available_methods}")
+
+                single = np.ndim(params) == 1
+                params = np.atleast_2d(params)
+
+                if method != "qiskit" or self._quantum_instance.is_statevector:
+                        if method == "numpy":
+                                if self._simulator is None:
+                                        self._simulator = TwoLocalSimulator.from_ansatz(self._ansatz)
+                                states = self._simulator.statevectors(params)
+                        elif method == "statevector":
+                                states = np.array([Statevector(self._ansatz.bind_parameters(p)).data for p in params])
+                        else:
+                                result = self._quantum_instance.execute(self._bind(params), had_transpiled=True)
+                                states = np.array([result.get_statevector(i) for i in range(params.shape[0])])
+                        if not return_expectation:
+                                return states[0] if single else states
+                        values = self.expectation(states) + self._offset
+
+                else:
+                        result = self._quantum_instance.execute(self._bind(params), had_transpiled=True)
+                        counts = [result.get_counts(i) for i in range(params.shape[0])]
+                        if not return_expectation:
+                                return counts[0] if single else counts
+                        values = np.array([self.expectation(c) for c in counts]) + self._offset
+
+                return float(values[0]) if single else values
+
+        def _z_terms(self) -> Tuple[ndarray, ndarray]:
+                """
+                Z masks and coefficients of the Hamiltonian, without building the operator when it was loaded from them.
+                """
+                if self._terms is not None:
+                        return self._terms
+                return z_terms(self._H)
+
+        def _bind(self, params: ndarray) -> List[QuantumCircuit]:
+                """
+                Bind each parameter vector to the ansatz, transpiled once per configuration.
+                """
+                template = self._template()
+
+                # Same parameter order as the VQE, the template may come from an equal ansatz with other parameters
+                return [template.bind_parameters(dict(zip(template.parameters, p))) for p in params]
+
+        def _template(self) -> QuantumCircuit:
+                """
+                Transpiled ansatz, with the measurements for shot based backends, shared through the circuit cache.
+                """
+                if self._transpiled is None:
+                        circuit = self._ansatz.copy()
+                        if not self._quantum_instance.is_statevector:
+                                circuit.measure_all()
+                        self._transpiled = self._quantum_instance.transpile(circuit)[0]
+                        self._circuits["transpiled"] = self._transpiled
+                return self._transpiled
 
         @property
         def qubo(self) -> object:
-                """ Returns qubo instance. """
+                """ Returns qubo instance (None for the "numpy" method or an Ising model loaded from a cache). """
                 return self._qubo
 
         @qubo.setter
@@ -141,12 +452,19 @@ class VQESolver():
         @property
         def H(self) -> ndarray:
                 """ Returns Ising model's hamiltonian. """
+                if self._H is None and self._terms is not None:
+                        self._H = z_operator(*self._terms)
                 return self._H
 
         @H.setter
         def H(self, value: ndarray) -> None:
-                """ Sets Ising model's hamiltonian. """
+                """ Sets Ising model's hamiltonian, the couplings and the spectrum of the previous one are dropped. """
                 self._H = value
+                self._terms = None
+                self._J = None
+                self._h = None
+                self._spectrum = None
+                self._num_qubits = value.num_qubits
 
         @property
         def offset(self) -> float:
@@ -167,4 +485,8 @@ class VQESolver():
         def num_qubits(self, value: int) -> None:
                 """ Sets number of qubits after convertion to Ising. """
                 self._num_qubits = value
-        
\ No newline at end of file
+
+        @property
+        def energies(self) -> Optional[ndarray]:
+                """ Returns the precomputed energy spectrum of the hamiltonian (None if not computed). """
+                return self._spectrum